@@ -0,0 +1,238 @@
+import io
+import os
+import base64
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from PIL import Image
+import main as converter
+
+IMAGE_SIZES = {"small": 300, "medium": 800, "large": 1600, "gif": 500}
+IMAGE_FORMATS = {"gif": "GIF"}
+CONTENT_TYPES = {"JPEG": "image/jpeg", "GIF": "image/gif"}
+
+
+def make_image(dimension, seed, fmt="JPEG"):
+    rng = random.Random(seed)
+    size = (dimension, dimension * 3 // 4)
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    noise = Image.effect_noise(size, 40).convert("RGB")
+    tint = Image.new("RGB", size, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    img = Image.blend(Image.blend(img, noise, 0.3), tint, 0.4)
+    buffer = io.BytesIO()
+    if fmt == "GIF":
+        img.convert("P", palette=Image.ADAPTIVE).save(buffer, "GIF")
+    else:
+        img.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ImageServer:
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.images = {name: make_image(dimension, name, IMAGE_FORMATS.get(name, "JPEG"))
+                       for name, dimension in IMAGE_SIZES.items()}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        images = self.images
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, send_body):
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 3 or parts[0] != "img" or parts[1] not in images:
+                    self.send_error(404)
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                if random.random() < server.failure_rate:
+                    self.send_error(503)
+                    return
+                body = images[parts[1]]
+                if self.headers.get("If-None-Match") == f'"{parts[1]}"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPES[IMAGE_FORMATS.get(parts[1], "JPEG")])
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", f'"{parts[1]}"')
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeStorage(converter.StorageBackend):
+    name = "benchmark"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def upload(self, name, f, content_type='image/png'):
+        data = f.read()
+        if self.latency:
+            time.sleep(self.latency)
+        md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode()
+        with self.lock:
+            self.objects[name] = (md5_hash, None)
+        return self.public_url(name)
+
+    def public_url(self, name):
+        return f"https://fake-storage.local/{self.name}/{name}"
+
+    def list_checksums(self):
+        with self.lock:
+            return dict(self.objects)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in IMAGE_SIZES:
+            raise ValueError(f"Unknown image size {name!r}, expected one of {', '.join(IMAGE_SIZES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _image_url(base_url, name, i):
+    extension = IMAGE_FORMATS.get(name, "JPEG").lower().replace("jpeg", "jpg")
+    return f"{base_url}/img/{name}/{i}.{extension}"
+
+
+def make_catalog(count, mix, base_url, seed=0):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    return [
+        {
+            "id": i,
+            "title": f"Product {i}",
+            "price": round(rng.uniform(1, 500), 2),
+            "image": _image_url(base_url, rng.choices(names, weights)[0], i),
+        }
+        for i in range(count)
+    ]
+
+
+def _run_engine(engine, catalog, options, upload_latency, results):
+    workdir = tempfile.mkdtemp(prefix=f"bench-{engine}-")
+    os.chdir(workdir)
+
+    start = time.perf_counter()
+    converter.main(catalog, os.path.join(workdir, "downloaded_images"), engine=engine,
+                   storage=FakeStorage(upload_latency), **options)
+    elapsed = time.perf_counter() - start
+
+    with open("updated_json.json") as f:
+        converted = sum(1 for product in json.load(f) if product["image"].startswith("https://fake-storage"))
+    summary = converter.METRICS.summary()
+    shutil.rmtree(workdir, ignore_errors=True)
+    results.put({
+        "engine": engine,
+        "images": len(catalog),
+        "converted": converted,
+        "seconds": elapsed,
+        "images_per_second": converted / elapsed if elapsed else 0.0,
+        "peak_rss_mb": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024,
+        "stages": {
+            stage: {
+                "p50_ms": stats["latency_p50"] * 1000,
+                "p99_ms": stats["latency_p99"] * 1000,
+                "errors": stats["errors"],
+            }
+            for stage, stats in summary["stages"].items()
+        },
+    })
+
+
+def run_benchmark(engine, catalog, options=None, upload_latency=0.0):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_engine,
+                                      args=(engine, catalog, options or {}, upload_latency, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def print_report(reports):
+    print(f"{'engine':<10} {'images':>9} {'images/s':>10} {'seconds':>9} {'rss MB':>8}  stage p50/p99 ms")
+    for report in reports:
+        stages = "  ".join(f"{stage} {stats['p50_ms']:.1f}/{stats['p99_ms']:.1f}"
+                           for stage, stats in report["stages"].items())
+        converted = f"{report['converted']}/{report['images']}"
+        print(f"{report['engine']:<10} {converted:>9} {report['images_per_second']:>10.1f} {report['seconds']:>9.2f} "
+              f"{report['peak_rss_mb']:>8.1f}  {stages}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the conversion engines against a local image server "
+                                                 "and an in-memory storage bucket.")
+    parser.add_argument("--images", type=int, default=200, help="number of products in the synthetic catalog")
+    parser.add_argument("--mix", default="small=6,medium=3,large=1,gif=1",
+                        help="image size weights, e.g. small=1,large=1")
+    parser.add_argument("--engines", default="serial,pipeline,async", help="comma separated engines to run")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of delay per image request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--upload-latency", type=float, default=0.0, help="seconds of delay per upload")
+    parser.add_argument("--options", default="{}", help="JSON object of extra options passed to main()")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = ImageServer(args.latency, args.failure_rate).start()
+    catalog = make_catalog(args.images, parse_mix(args.mix), server.base_url)
+    try:
+        reports = [run_benchmark(engine, catalog, json.loads(args.options), args.upload_latency)
+                   for engine in args.engines.split(",")]
+    finally:
+        server.stop()
+
+    print_report(reports)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=4)
+    if not args.failure_rate and any(report["converted"] < report["images"] for report in reports):
+        raise SystemExit("Some images were not converted")
@@ -1,538 +1,2400 @@
 import os
+import io
 import json
+import time
+import random
+import queue
+import sqlite3
+import base64
+import hashlib
+import textwrap
+import itertools
+import functools
+import re
+import sys
+import inspect
+import glob
+import socket
+import multiprocessing
+import bisect
+import argparse
+import cProfile
+import pstats
+import logging
+import contextlib
+import tracemalloc
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import aiohttp
 import requests
 from urllib.parse import urlparse
-from PIL import Image
-import firebase_admin
-from firebase_admin import credentials, storage
+from PIL import Image, ImageCms, ImageOps, ExifTags
 
+logger = logging.getLogger("convert_to_png")
 
-def initialize_firebase():
-    cred = credentials.Certificate("serviceAccountKey.json")
+DEFAULT_TIMEOUT = (10, 60)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_BACKOFF = 30
+MAX_DOWNLOAD_BYTES = 50 << 20
+
+
+def initialize_firebase(credentials_path="serviceAccountKey.json", bucket='<Firebase Storage Bucket Url>'):
+    import firebase_admin
+    from firebase_admin import credentials
+
+    cred = credentials.Certificate(credentials_path)
     firebase_admin.initialize_app(cred, {
-        'storageBucket': '<Firebase Storage Bucket Url>'
+        'storageBucket': bucket
     })
 
 
-def download_image(url, folder):
+class StorageBackend:
+    name = "storage"
+    batch_workers = 4
+
+    def upload(self, name, f, content_type='image/png'):
+        raise NotImplementedError
+
+    def public_url(self, name):
+        raise NotImplementedError
+
+    def list_checksums(self):
+        return {}
+
+    def identity(self):
+        return f"{type(self).__name__}:{self.name}"
+
+    def upload_many(self, items, content_type='image/png'):
+        def upload_one(item):
+            name, opener = item
+            with opener() as f:
+                return self.upload(name, f, content_type)
+
+        if len(items) <= 1:
+            return [upload_one(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.batch_workers, len(items))) as pool:
+            return list(pool.map(upload_one, items))
+
+
+class FirebaseBackend(StorageBackend):
+    def __init__(self, bucket_name=None, chunk_size=None, timeout=60):
+        self.bucket_name = bucket_name
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                from firebase_admin import storage
+                self._bucket = storage.bucket(self.bucket_name)
+            return self._bucket
+
+    @property
+    def name(self):
+        return self.bucket.name
+
+    def identity(self):
+        return f"{type(self).__name__}:{self.bucket_name or 'default'}"
+
+    def upload(self, name, f, content_type='image/png'):
+        blob = self.bucket.blob(name, chunk_size=self.chunk_size)
+        blob.upload_from_file(f, content_type=content_type, predefined_acl="publicRead", timeout=self.timeout)
+        return blob.public_url
+
+    def public_url(self, name):
+        return self.bucket.blob(name).public_url
+
+    def list_checksums(self):
+        return {blob.name: (blob.md5_hash, blob.crc32c)
+                for blob in self.bucket.list_blobs(fields="items(name,md5Hash,crc32c),nextPageToken")}
+
+
+class S3Backend(StorageBackend):
+    def __init__(self, bucket_name, endpoint_url=None, public_base_url=None, region_name=None, acl="public-read",
+                 multipart_threshold=8 << 20, multipart_chunksize=8 << 20, timeout=DEFAULT_TIMEOUT):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.public_base_url = public_base_url
+        self.acl = acl
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name,
+                                   config=Config(connect_timeout=timeout[0], read_timeout=timeout[1]))
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_chunksize)
+
+    def upload(self, name, f, content_type='image/png'):
+        extra_args = {"ContentType": content_type}
+        if self.acl:
+            extra_args["ACL"] = self.acl
+        self.client.upload_fileobj(f, self.name, name, ExtraArgs=extra_args, Config=self.transfer_config)
+        return self.public_url(name)
+
+    def public_url(self, name):
+        if self.public_base_url:
+            return f"{self.public_base_url.rstrip('/')}/{name}"
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.name}/{name}"
+        return f"https://{self.name}.s3.amazonaws.com/{name}"
+
+    def identity(self):
+        return f"{type(self).__name__}:{self.endpoint_url}:{self.name}:{self.public_base_url}"
+
+    def list_checksums(self):
+        checksums = {}
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.name):
+            for item in page.get("Contents", []):
+                etag = item["ETag"].strip('"')
+                if "-" in etag:
+                    checksums[item["Key"]] = (None, None)
+                else:
+                    checksums[item["Key"]] = (base64.b64encode(bytes.fromhex(etag)).decode(), None)
+        return checksums
+
+
+class LocalBackend(StorageBackend):
+    def __init__(self, directory, base_url=None):
+        self.name = directory
+        self.directory = directory
+        self.base_url = base_url
+
+    def upload(self, name, f, content_type='image/png'):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as out:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                out.write(chunk)
+        os.replace(tmp_path, path)
+        return self.public_url(name)
+
+    def public_url(self, name):
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{name}"
+        return "file://" + os.path.abspath(os.path.join(self.directory, name))
+
+    def identity(self):
+        return f"{type(self).__name__}:{os.path.abspath(self.directory)}:{self.base_url}"
+
+    def list_checksums(self):
+        checksums = {}
+        if not os.path.isdir(self.directory):
+            return checksums
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                md5 = hashlib.md5()
+                with open(entry.path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 16), b""):
+                        md5.update(chunk)
+                checksums[entry.name] = (base64.b64encode(md5.digest()).decode(), None)
+        return checksums
+
+
+STORAGE_BACKENDS = {
+    "firebase": FirebaseBackend,
+    "s3": S3Backend,
+    "local": LocalBackend,
+}
+
+_storage = None
+
+
+def set_storage(storage):
+    global _storage
+    _storage = storage
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = FirebaseBackend()
+    return _storage
+
+
+class Uploaded:
+    def __init__(self, value):
+        self.value = value
+
+
+def _encode_mapping_value(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _decode_mapping_value(value):
+    return json.loads(value) if value and value.startswith('{') else value
+
+
+class ImageCache:
+    def __init__(self, path, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "url TEXT PRIMARY KEY, etag TEXT, content_hash TEXT, firebase_url TEXT, updated_at REAL, "
+            "last_modified TEXT, fingerprint TEXT)"
+        )
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(images)")}
+        for column in ("last_modified", "fingerprint"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE images ADD COLUMN {column} TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_content_hash ON images (content_hash)")
+        self.conn.commit()
+
+    def get(self, url):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT etag, last_modified, content_hash, firebase_url, fingerprint FROM images WHERE url = ?",
+                (url,)
+            ).fetchone()
+
+    def find_by_hash(self, content_hash):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT firebase_url FROM images WHERE content_hash = ? AND firebase_url IS NOT NULL "
+                "AND fingerprint IS ?",
+                (content_hash, self.fingerprint)
+            ).fetchone()
+        return _decode_mapping_value(row[0]) if row else None
+
+    def validators(self, url):
+        row = self.get(url)
+        if not row or not row["firebase_url"] or not (row["etag"] or row["last_modified"]):
+            return {}, None
+        if row["fingerprint"] != self.fingerprint:
+            return {}, None
+        headers = {}
+        if row["etag"]:
+            headers['If-None-Match'] = row["etag"]
+        if row["last_modified"]:
+            headers['If-Modified-Since'] = row["last_modified"]
+        return headers, _decode_mapping_value(row["firebase_url"])
+
+    def record_download(self, url, etag, last_modified, content_hash):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO images (url, etag, last_modified, content_hash, firebase_url, updated_at) "
+                "VALUES (?, ?, ?, ?, NULL, ?) ON CONFLICT (url) DO UPDATE SET "
+                "etag = excluded.etag, last_modified = excluded.last_modified, "
+                "content_hash = excluded.content_hash, "
+                "firebase_url = CASE WHEN images.content_hash = excluded.content_hash "
+                "THEN images.firebase_url END, updated_at = excluded.updated_at",
+                (url, etag, last_modified, content_hash, time.time())
+            )
+            self.conn.commit()
+
+    def record_uploads(self, url_mapping):
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE images SET firebase_url = ?, fingerprint = ?, updated_at = ? WHERE url = ?",
+                [(_encode_mapping_value(firebase_url), self.fingerprint, time.time(), url)
+                 for url, firebase_url in url_mapping.items()]
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def evict_downloads(folder, max_bytes=None, max_age=None):
+    now = time.time()
+    files = []
+    for entry in os.scandir(folder):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        expired = max_age is not None and now - mtime > max_age
+        oversized = max_bytes is not None and total > max_bytes
+        if not expired and not oversized:
+            continue
+        os.remove(path)
+        total -= size
+        logger.debug("Evicted cached file: %s", path)
+
+
+class ImageBuffer:
+    def __init__(self, name, folder, spool_size):
+        self.name = name
+        self.folder = folder
+        self.spool_size = spool_size
+        self.data = bytearray()
+        self.file = None
+        self.size = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.file:
+            self.file.write(chunk)
+            return
+        self.data += chunk
+        if len(self.data) > self.spool_size:
+            self.file = open(os.path.join(self.folder, self.name), 'wb')
+            self.file.write(self.data)
+            self.data = None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        elif self.data is not None:
+            self.data = bytes(self.data)
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(os.path.join(self.folder, self.name), 'rb')
+
+    def spill(self):
+        if self.data is not None:
+            with open(os.path.join(self.folder, self.name), 'wb') as f:
+                f.write(self.data)
+            self.data = None
+
+    def discard(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.data is None:
+            os.remove(os.path.join(self.folder, self.name))
+        self.data = b""
+
+    def __str__(self):
+        if self.data is not None:
+            return f"<memory>/{self.name}"
+        return os.path.join(self.folder, self.name)
+
+
+class RetryableHTTPError(Exception):
+    def __init__(self, status, url, retry_after=None):
+        super().__init__(f"{status} response for {url}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class HostRateLimiter:
+    def __init__(self, min_interval=0.05, max_interval=5.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.lock = threading.Lock()
+        self.intervals = {}
+        self.next_slot = {}
+
+    def reserve(self, host):
+        with self.lock:
+            interval = self.intervals.get(host, 0.0)
+            if not interval:
+                return 0.0
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + interval
+            return slot - now
+
+    def throttle(self, host, retry_after=None):
+        with self.lock:
+            interval = max(self.min_interval, self.intervals.get(host, 0.0) * 1.5)
+            if retry_after:
+                interval = max(interval, retry_after)
+            self.intervals[host] = min(interval, self.max_interval)
+        logger.info("Throttled by %s, spacing requests %.2fs apart", host, self.intervals[host])
+
+    def relax(self, host):
+        with self.lock:
+            interval = self.intervals.get(host)
+            if interval:
+                interval *= 0.8
+                self.intervals[host] = interval if interval >= self.min_interval else 0.0
+
+
+RATE_LIMITER = HostRateLimiter()
+
+
+def _retry_after(headers):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        url_path = urlparse(url).path
-        filename = os.path.basename(url_path)
-        filepath = os.path.join(folder, filename)
-
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
-        print(f"Image downloaded: {filepath}")
-        return filepath
-    except Exception as e:
-        print(f"Failed to download {url}: {e}")
+        return min(float(headers.get('Retry-After')), MAX_BACKOFF)
+    except (TypeError, ValueError):
+        return None
+
+
+def _check_status(status, headers, url):
+    if status in RETRY_STATUSES:
+        raise RetryableHTTPError(status, url, _retry_after(headers))
+
+
+def _backoff_delay(attempt, backoff, retry_after=None):
+    if retry_after:
+        return retry_after
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt))
+
+
+def _error_status(error):
+    if isinstance(error, RetryableHTTPError):
+        return error.status
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return getattr(error, 'code', None) or getattr(response, 'status_code', None)
+
+
+def _is_retryable(error):
+    if isinstance(error, (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout,
+                          requests.exceptions.ChunkedEncodingError, aiohttp.ClientConnectionError,
+                          aiohttp.ClientPayloadError, asyncio.TimeoutError)):
+        return True
+    return _error_status(error) in RETRY_STATUSES
+
+
+def _retry_delay(key, error, attempt_number, retries, backoff):
+    if attempt_number >= retries or not _is_retryable(error):
+        raise error
+    retry_after = getattr(error, 'retry_after', None)
+    if _error_status(error) in (429, 503):
+        RATE_LIMITER.throttle(key, retry_after)
+    delay = _backoff_delay(attempt_number, backoff, retry_after)
+    logger.debug("Retrying %s in %.2fs after %s", key, delay, error)
+    return delay
+
+
+def with_retries(key, attempt, retries=3, backoff=0.5):
+    for attempt_number in itertools.count():
+        time.sleep(RATE_LIMITER.reserve(key))
+        try:
+            result = attempt()
+        except Exception as e:
+            time.sleep(_retry_delay(key, e, attempt_number, retries, backoff))
+            continue
+        RATE_LIMITER.relax(key)
+        return result
+
+
+async def with_retries_async(key, attempt, retries=3, backoff=0.5):
+    for attempt_number in itertools.count():
+        await asyncio.sleep(RATE_LIMITER.reserve(key))
+        try:
+            result = await attempt()
+        except Exception as e:
+            await asyncio.sleep(_retry_delay(key, e, attempt_number, retries, backoff))
+            continue
+        RATE_LIMITER.relax(key)
+        return result
+
+
+def _url_filename(url):
+    path = urlparse(url).path
+    stem, ext = os.path.splitext(os.path.basename(path))
+    digest = hashlib.sha1(url.encode()).hexdigest()[:12]
+    return f"{stem or 'image'}-{digest}{ext}"
+
+
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\x00\x00\x01\x00", "ico"),
+)
+
+NON_IMAGE_TYPES = ("text/", "application/json", "application/xml", "application/javascript", "application/pdf")
+
+
+def sniff_image_type(head):
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis", b"heic", b"heix", b"mif1"):
+        return head[8:12].decode()
+    return None
+
+
+class RejectedDownload(Exception):
+    pass
+
+
+class DownloadStream:
+    def __init__(self, url, buffer, max_bytes=MAX_DOWNLOAD_BYTES):
+        self.url = url
+        self.buffer = buffer
+        self.max_bytes = max_bytes
+        self.content_hash = hashlib.sha256()
+        self.head = b""
+        self.kind = None
+
+    def check_headers(self, headers):
+        length = headers.get('Content-Length', '')
+        if self.max_bytes and length.isdigit() and int(length) > self.max_bytes:
+            raise RejectedDownload(f"{self.url} is {length} bytes, limit is {self.max_bytes}")
+        content_type = headers.get('Content-Type', '').lower()
+        if content_type.startswith(NON_IMAGE_TYPES):
+            raise RejectedDownload(f"{self.url} is {content_type.split(';')[0]}, not an image")
+
+    def write(self, chunk):
+        if self.max_bytes and self.buffer.size + len(chunk) > self.max_bytes:
+            raise RejectedDownload(f"{self.url} is larger than {self.max_bytes} bytes")
+        if self.kind is None:
+            self.head += chunk[:16 - len(self.head)]
+            if len(self.head) == 16:
+                self._sniff()
+        self.content_hash.update(chunk)
+        self.buffer.write(chunk)
+
+    def _sniff(self):
+        self.kind = sniff_image_type(self.head)
+        if not self.kind:
+            raise RejectedDownload(f"{self.url} does not look like an image")
+
+    def finish(self):
+        if self.kind is None:
+            self._sniff()
+        self.buffer.close()
+        return self
+
+    def discard(self):
+        self.buffer.discard()
+
+
+def _cached_upload(url, headers, content_hash, cache):
+    if not cache:
         return None
+    cache.record_download(url, headers.get('ETag'), headers.get('Last-Modified'), content_hash)
+    firebase_url = cache.find_by_hash(content_hash)
+    if firebase_url:
+        logger.debug("Reusing uploaded image for %s: %s", url, firebase_url)
+        return Uploaded(firebase_url)
+    return None
+
+
+def _conditional_headers(url, cache):
+    if not cache:
+        return {}, None
+    return cache.validators(url)
+
+
+def _not_modified(url, firebase_url):
+    logger.debug("Image not modified: %s", url)
+    return Uploaded(firebase_url)
+
+
+def _finish_download(url, stream, headers, cache):
+    firebase_url = _cached_upload(url, headers, stream.content_hash.hexdigest(), cache)
+    if firebase_url:
+        stream.discard()
+        return firebase_url
+    logger.debug("Image downloaded: %s (%d bytes, %s)", stream.buffer, stream.buffer.size, stream.kind)
+    return stream.buffer
+
 
+def _store_download(url, stream, headers, cache):
+    stream.buffer.spill()
+    buffer = _finish_download(url, stream, headers, cache)
+    return str(buffer) if isinstance(buffer, ImageBuffer) else buffer
 
-def convert_image_to_png(image_path):
+
+def _stream_download(url, buffer, validators, timeout, max_bytes):
+    stream = DownloadStream(url, buffer, max_bytes)
     try:
-        with Image.open(image_path) as img:
-            png_path = os.path.splitext(image_path)[0] + ".png"
-            img.save(png_path, 'PNG')
-            print(f"Converted image saved: {png_path}")
-            return png_path
+        with requests.get(url, headers=validators, stream=True, timeout=timeout) as response:
+            _check_status(response.status_code, response.headers, url)
+            response.raise_for_status()
+            if response.status_code == 304:
+                return None, response.headers
+            stream.check_headers(response.headers)
+            for chunk in response.iter_content(1 << 16):
+                stream.write(chunk)
+        return stream.finish(), response.headers
+    except BaseException:
+        stream.discard()
+        raise
+
+
+def download_image(url, folder, cache=None, timeout=DEFAULT_TIMEOUT, retries=3, backoff=0.5,
+                   max_bytes=MAX_DOWNLOAD_BYTES):
+    buffer = download_image_to_buffer(url, folder, cache, 0, timeout, retries, backoff, max_bytes)
+    if isinstance(buffer, ImageBuffer):
+        return str(buffer)
+    return buffer
+
+
+def download_image_to_buffer(url, folder, cache=None, spool_size=8 << 20, timeout=DEFAULT_TIMEOUT, retries=3,
+                             backoff=0.5, max_bytes=MAX_DOWNLOAD_BYTES):
+    validators, cached_url = _conditional_headers(url, cache)
+
+    def attempt():
+        buffer = ImageBuffer(_url_filename(url), folder, spool_size)
+        return _stream_download(url, buffer, validators, timeout, max_bytes)
+
+    try:
+        stream, headers = with_retries(urlparse(url).netloc, attempt, retries, backoff)
+        if stream is None and cached_url:
+            return _not_modified(url, cached_url)
+        return _finish_download(url, stream, headers, cache)
     except Exception as e:
-        print(f"Failed to convert {image_path} to PNG: {e}")
+        logger.warning("Failed to download %s: %s", url, e)
         return None
 
 
-def upload_image_to_firebase(image_path):
+def _download_func(download_folder, cache, spool_size, download_options=None):
+    if spool_size is None:
+        return lambda url: download_image(url, download_folder, cache, **(download_options or {}))
+    return lambda url: download_image_to_buffer(url, download_folder, cache, spool_size, **(download_options or {}))
+
+
+PNG_PROFILES = {
+    "default": {},
+    "fast": {"compress_level": 1},
+    "balanced": {"compress_level": 6},
+    "small": {"compress_level": 9, "optimize": True, "quantize": 256},
+    "tiny": {"compress_level": 9, "optimize": True, "quantize": 16, "bits": 4},
+}
+
+
+def _encode_png(img, fp, profile):
+    options = dict(PNG_PROFILES[profile])
+    colors = options.pop("quantize", None)
+    if colors:
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+        method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT
+        img = img.quantize(colors, method=method)
+    elif "bits" in options and img.mode != "P":
+        del options["bits"]
+    if img.info.get("exif"):
+        options["exif"] = img.info["exif"]
+    img.save(fp, 'PNG', **options)
+
+
+METADATA_POLICIES = ("keep", "icc", "strip")
+
+
+@functools.lru_cache(maxsize=32)
+def _srgb_transform(icc_profile, mode, output_mode):
+    source = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+    return ImageCms.buildTransform(source, ImageCms.createProfile("sRGB"), mode, output_mode)
+
+
+def _to_srgb(img, output_mode):
+    info = {key: value for key, value in img.info.items() if key != "icc_profile"}
+    icc_profile = img.info.get("icc_profile")
+    converted = None
+    if icc_profile:
+        try:
+            converted = ImageCms.applyTransform(img, _srgb_transform(icc_profile, img.mode, output_mode))
+        except (ImageCms.PyCMSError, OSError) as e:
+            logger.debug("Ignoring unusable ICC profile: %s", e)
+    if converted is None:
+        converted = img.convert(output_mode)
+    converted.info = info
+    return converted
+
+
+def _normalize_mode(img, metadata="icc"):
+    if metadata not in METADATA_POLICIES:
+        raise ValueError(f"unknown metadata policy {metadata!r}, expected one of {', '.join(METADATA_POLICIES)}")
+    if img.mode == "CMYK":
+        return _to_srgb(img, "RGB")
+    if img.mode.startswith("I;16") or img.mode == "I":
+        return _to_8bit(img)
+    if metadata == "strip" and img.info.get("icc_profile") and img.mode in ("RGB", "RGBA"):
+        return _to_srgb(img, img.mode)
+    return img
+
+
+def _normalize_image(img, metadata="icc"):
+    if img.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA") and img.getchannel("A").getextrema() == (255, 255):
+        img = img.convert(img.mode[:-1])
+
+    if metadata != "keep":
+        kept = ("transparency", "icc_profile") if metadata == "icc" else ("transparency",)
+        img.info = {key: img.info[key] for key in kept if key in img.info}
+    return img
+
+
+def _to_8bit(img):
+    if img.mode == "I" and img.getextrema()[1] <= 255:
+        return img.convert("L")
+    return img.convert("I").point(lambda value: value * (1 / 256)).convert("L")
+
+
+def _reducible(img):
+    if img.mode in ("P", "PA"):
+        return img.convert("RGBA" if img.has_transparency_data else "RGB")
+    if img.mode == "1":
+        return img.convert("L")
+    return img
+
+
+def _shrink(img, max_dimension):
+    if max(img.size) <= max_dimension:
+        return img
+    img = _reducible(img)
+    factor = max(img.size) // max_dimension
+    if factor >= 2:
+        img = img.reduce(factor)
+    if max(img.size) > max_dimension:
+        scale = max_dimension / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+
+def _decode_image(img, max_dimension=None, max_pixels=Image.MAX_IMAGE_PIXELS, metadata="icc"):
+    if max_dimension and img.format == "JPEG":
+        img.draft(img.mode, (max_dimension, max_dimension))
+    if max_pixels and img.width * img.height > max_pixels:
+        raise ValueError(f"refusing to decode {img.width}x{img.height} image, limit is {max_pixels} pixels")
+    img = _normalize_mode(img, metadata)
+    if max_dimension:
+        img = _shrink(img, max_dimension)
+    return img
+
+
+def _png_target(image_path, suffix=""):
+    if isinstance(image_path, ImageBuffer):
+        name = os.path.splitext(image_path.name)[0] + suffix + ".png"
+        return ImageBuffer(name, image_path.folder, image_path.spool_size)
+    return os.path.splitext(image_path)[0] + suffix + ".png"
+
+
+def _save_png(img, target, profile):
+    start = time.perf_counter()
+    _encode_png(img, target, profile)
+    elapsed = time.perf_counter() - start
+    if isinstance(target, ImageBuffer):
+        target.close()
+        size = target.size
+    else:
+        size = os.path.getsize(target)
+    logger.debug("Converted image saved: %s (%d bytes, %.1f ms, %s)", target, size, elapsed * 1000, profile)
+    return target
+
+
+def convert_image_to_png(image_path, profile="default", max_dimension=None, max_pixels=Image.MAX_IMAGE_PIXELS,
+                         variants=(), metadata="icc"):
+    if isinstance(image_path, Uploaded):
+        return image_path
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(os.path.basename(image_path))
-        blob.upload_from_filename(image_path)
-        blob.make_public()
-        print(f"Image uploaded to Firebase: {blob.public_url}")
-        return blob.public_url
+        source = image_path.open() if isinstance(image_path, ImageBuffer) else open(image_path, 'rb')
+        with source:
+            reencode = profile != "default" or max_dimension or variants or metadata == "strip"
+            if not reencode and sniff_image_type(source.read(16)) == "png":
+                logger.debug("Image is already PNG, skipping conversion: %s", image_path)
+                return image_path
+            source.seek(0)
+            with Image.open(source) as img:
+                img = _normalize_image(_decode_image(img, max_dimension, max_pixels, metadata), metadata)
+                png = _save_png(img, _png_target(image_path), profile)
+                if not variants:
+                    return png
+
+                outputs = {"full": png}
+                for size in sorted(variants, reverse=True):
+                    img = _shrink(img, size)
+                    outputs[str(size)] = _save_png(img, _png_target(image_path, f"_{size}"), profile)
+                return outputs
     except Exception as e:
-        print(f"Failed to upload {image_path} to Firebase: {e}")
+        logger.warning("Failed to convert %s to PNG: %s", image_path, e)
         return None
 
 
-def replace_urls_in_json(obj, url_mapping):
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if key == "image" and value in url_mapping:
-                obj[key] = url_mapping[value]
+def output_fingerprint(storage, convert_options=None, upload_options=None):
+    convert = inspect.signature(convert_image_to_png).bind_partial(None, **(convert_options or {}))
+    convert.apply_defaults()
+    settings = dict(convert.arguments, image_path=None, variants=sorted(convert.arguments["variants"]))
+    settings["hash_names"] = bool((upload_options or {}).get("hash_names"))
+    settings["storage"] = storage.identity()
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def open_cache(cache_path, engine_options):
+    if not cache_path:
+        return None
+    fingerprint = output_fingerprint(get_storage(), engine_options.get("convert_options"),
+                                     engine_options.get("upload_options"))
+    return ImageCache(cache_path, fingerprint)
+
+
+class RemoteIndex:
+    def __init__(self, storage):
+        self.storage = storage
+        self.lock = threading.Lock()
+        self.objects = None
+
+    def _load(self):
+        objects = self.storage.list_checksums()
+        logger.info("Indexed %d existing objects in %s", len(objects), self.storage.name)
+        return objects
+
+    def matches(self, name, checksums):
+        with self.lock:
+            if self.objects is None:
+                self.objects = self._load()
+            remote = self.objects.get(name)
+        if not remote:
+            return False
+        md5_hash, crc32c = remote
+        if md5_hash:
+            return md5_hash == checksums.md5_hash
+        return crc32c is not None and crc32c == checksums.crc32c()
+
+    def add(self, name, checksums):
+        with self.lock:
+            if self.objects is not None:
+                self.objects[name] = (checksums.md5_hash, None)
+
+
+_remote_indexes = {}
+_remote_indexes_lock = threading.Lock()
+
+
+def get_remote_index(storage):
+    with _remote_indexes_lock:
+        if storage not in _remote_indexes:
+            _remote_indexes[storage] = RemoteIndex(storage)
+        return _remote_indexes[storage]
+
+
+class Checksums:
+    def __init__(self, image_path):
+        self.image_path = image_path
+        md5 = hashlib.md5()
+        with _open_png(image_path) as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                md5.update(chunk)
+        self.hexdigest = md5.hexdigest()
+        self.md5_hash = base64.b64encode(md5.digest()).decode()
+
+    def crc32c(self):
+        import google_crc32c
+        crc = google_crc32c.Checksum()
+        with _open_png(self.image_path) as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                crc.update(chunk)
+        return base64.b64encode(crc.digest()).decode()
+
+
+def _open_png(image_path):
+    if isinstance(image_path, ImageBuffer):
+        return image_path.open()
+    return open(image_path, 'rb')
+
+
+def upload_image_to_firebase(image_path, storage=None, hash_names=False, skip_existing=False, retries=3, backoff=0.5):
+    if isinstance(image_path, Uploaded):
+        return image_path.value
+    try:
+        storage = storage or get_storage()
+        items = image_path.items() if isinstance(image_path, dict) else [(None, image_path)]
+        urls = {}
+        pending = []
+        for label, path in items:
+            name = path.name if isinstance(path, ImageBuffer) else os.path.basename(path)
+            name = os.path.splitext(name)[0] + ".png"
+            checksums = Checksums(path) if hash_names or skip_existing else None
+            if hash_names:
+                name = checksums.hexdigest + ".png"
+            if skip_existing and get_remote_index(storage).matches(name, checksums):
+                urls[label] = storage.public_url(name)
+                logger.debug("Image already in %s: %s", storage.name, urls[label])
             else:
-                replace_urls_in_json(value, url_mapping)
-    elif isinstance(obj, list):
-        for item in obj:
-            replace_urls_in_json(item, url_mapping)
-
-
-def extract_image_urls(obj):
-    image_urls = []
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if key == "image" and isinstance(value, str):
-                image_urls.append(value)
+                pending.append((label, name, path, checksums))
+
+        items = [(name, functools.partial(_open_png, path)) for _, name, path, _ in pending]
+        uploaded = with_retries(storage.name, lambda: storage.upload_many(items), retries, backoff)
+        for (label, name, path, checksums), url in zip(pending, uploaded):
+            urls[label] = url
+            if skip_existing:
+                get_remote_index(storage).add(name, checksums)
+            logger.debug("Image uploaded to %s: %s", storage.name, url)
+        return urls if isinstance(image_path, dict) else urls[None]
+    except Exception as e:
+        logger.warning("Failed to upload %s: %s", image_path, e)
+        return None
+
+
+IMAGE_KEYS = ("image",)
+
+ImageField = namedtuple("ImageField", "parent key url owner owner_key")
+
+_DESCEND = object()
+_SELECTOR_TOKEN = re.compile(r"""\.\.([A-Za-z_][\w-]*|\*)?|\.([A-Za-z_][\w-]*|\*)|\[(\d+|\*|'[^']*'|"[^"]*")\]""")
+
+
+def compile_selector(selector):
+    text = selector.strip()
+    if text.startswith("$"):
+        text = text[1:]
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _SELECTOR_TOKEN.match(text, pos)
+        if not match:
+            raise ValueError(f"Invalid selector {selector!r} at position {pos}")
+        descend_name, name, bracket = match.groups()
+        if match.group(0).startswith(".."):
+            tokens.append(_DESCEND)
+            if descend_name:
+                tokens.append(descend_name)
+        elif name:
+            tokens.append(name)
+        elif bracket.isdigit():
+            tokens.append(int(bracket))
+        else:
+            tokens.append(bracket.strip("'\""))
+        pos = match.end()
+    return tokens
+
+
+def _closure(tokens, states):
+    states = set(states)
+    for i in sorted(states):
+        while i < len(tokens) and tokens[i] is _DESCEND:
+            i += 1
+            states.add(i)
+    return states
+
+
+def selector_matches(tokens, path):
+    states = _closure(tokens, {0})
+    for element in path:
+        next_states = set()
+        for i in states:
+            if i == len(tokens):
+                continue
+            token = tokens[i]
+            if token is _DESCEND:
+                next_states.add(i)
+            elif token == "*" or token == element:
+                next_states.add(i + 1)
+        states = _closure(tokens, next_states)
+        if not states:
+            return False
+    return len(tokens) in states
+
+
+def find_image_fields(obj, keys=IMAGE_KEYS, selectors=()):
+    compiled = [compile_selector(selector) if isinstance(selector, str) else selector for selector in selectors]
+    fields = []
+    stack = [(obj, (), None, None, None, None)]
+    while stack:
+        node, path, parent, key, owner, owner_key = stack.pop()
+        if isinstance(node, str):
+            if owner_key in keys or any(selector_matches(tokens, path) for tokens in compiled):
+                fields.append(ImageField(parent, key, node, owner, owner_key))
+        elif isinstance(node, dict):
+            stack.extend((value, path + (child_key,) if compiled else path, node, child_key, node, child_key)
+                         for child_key, value in reversed(node.items()))
+        elif isinstance(node, list):
+            stack.extend((value, path + (index,) if compiled else path, node, index, owner, owner_key)
+                         for index, value in reversed(list(enumerate(node))))
+    return fields
+
+
+def replace_urls_in_json(obj, url_mapping, image_fields=None, keys=IMAGE_KEYS, selectors=()):
+    if image_fields is None:
+        image_fields = find_image_fields(obj, keys, selectors)
+
+    variants = {}
+    for field in image_fields:
+        if field.url not in url_mapping:
+            continue
+        new_value = url_mapping[field.url]
+        if isinstance(new_value, dict):
+            if isinstance(field.owner, dict):
+                owner_variants = variants.setdefault(id(field.owner), (field.owner, {}))[1]
+                labels = {label: url for label, url in new_value.items() if label != "full"}
+                if isinstance(field.key, int):
+                    aligned = owner_variants.setdefault(field.owner_key, [None] * len(field.parent))
+                    aligned[field.key] = labels
+                else:
+                    owner_variants[field.owner_key] = labels
+            new_value = new_value["full"]
+        field.parent[field.key] = new_value
+
+    for owner, owner_variants in variants.values():
+        items = list(owner.items())
+        owner.clear()
+        for key, value in items:
+            owner[key] = value
+            if key in owner_variants:
+                owner[key + "_variants"] = owner_variants[key]
+
+
+def extract_image_urls(obj, keys=IMAGE_KEYS, selectors=()):
+    return [field.url for field in find_image_fields(obj, keys, selectors)]
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _payload_size(value):
+    if isinstance(value, ImageBuffer):
+        return value.size
+    if isinstance(value, dict):
+        return sum(_payload_size(item) for item in value.values())
+    if isinstance(value, str) and os.path.isfile(value):
+        return os.path.getsize(value)
+    return 0
+
+
+def _quantile(samples, q):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.latencies = defaultdict(list)
+            self.errors = Counter()
+            self.bytes_in = Counter()
+            self.bytes_out = Counter()
+            self.busy = defaultdict(lambda: [0, 0.0])
+            self.skipped = defaultdict(lambda: [0, 0.0])
+            self.gauges = {}
+            self.gauge_max = Counter()
+
+    def observe(self, stage, elapsed, source, result):
+        bytes_in = _payload_size(source)
+        bytes_out = _payload_size(result)
+        skipped = isinstance(source, Uploaded) or isinstance(result, Uploaded)
+        with self.lock:
+            self.latencies[stage].append(elapsed)
+            totals = self.skipped[stage] if skipped else self.busy[stage]
+            totals[0] += 1
+            totals[1] += elapsed
+            if not result:
+                self.errors[stage] += 1
+            self.bytes_in[stage] += bytes_in
+            self.bytes_out[stage] += bytes_out
+
+    def timed(self, stage, func):
+        def wrapper(value, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(value, *args, **kwargs)
+            except Exception:
+                self.observe(stage, time.perf_counter() - start, value, None)
+                raise
+            self.observe(stage, time.perf_counter() - start, value, result)
+            return result
+        return wrapper
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+            self.gauge_max[name] = max(self.gauge_max[name], value)
+
+    def adjust(self, name, delta):
+        with self.lock:
+            value = self.gauges.get(name, 0) + delta
+            self.gauges[name] = value
+            self.gauge_max[name] = max(self.gauge_max[name], value)
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            stages = {}
+            for stage, samples in self.latencies.items():
+                samples = sorted(samples)
+                succeeded = len(samples) - self.errors[stage]
+                stages[stage] = {
+                    "count": len(samples),
+                    "errors": self.errors[stage],
+                    "latency_sum": sum(samples),
+                    "latency_p50": _quantile(samples, 0.5),
+                    "latency_p90": _quantile(samples, 0.9),
+                    "latency_p99": _quantile(samples, 0.99),
+                    "latency_max": samples[-1] if samples else 0.0,
+                    "latency_buckets": {str(bound): bisect.bisect_right(samples, bound) for bound in LATENCY_BUCKETS},
+                    "bytes_in": self.bytes_in[stage],
+                    "bytes_out": self.bytes_out[stage],
+                    "images_per_second": succeeded / elapsed if elapsed else 0.0,
+                    "work_count": self.busy[stage][0],
+                    "work_seconds": self.busy[stage][1],
+                    "skipped_count": self.skipped[stage][0],
+                    "skipped_seconds": self.skipped[stage][1],
+                }
+            gauges = {name: {"current": value, "max": self.gauge_max[name]} for name, value in self.gauges.items()}
+        return {"elapsed_seconds": elapsed, "stages": stages, "gauges": gauges}
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = [
+            "# TYPE convert_to_png_stage_latency_seconds histogram",
+        ]
+        for stage, stats in summary["stages"].items():
+            for bound, count in stats["latency_buckets"].items():
+                lines.append(f'convert_to_png_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'convert_to_png_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'convert_to_png_stage_latency_seconds_sum{{stage="{stage}"}} {stats["latency_sum"]}')
+            lines.append(f'convert_to_png_stage_latency_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for metric, field in (("errors_total", "errors"), ("bytes_in_total", "bytes_in"),
+                              ("bytes_out_total", "bytes_out"), ("images_per_second", "images_per_second")):
+            kind = "gauge" if metric == "images_per_second" else "counter"
+            lines.append(f"# TYPE convert_to_png_stage_{metric} {kind}")
+            for stage, stats in summary["stages"].items():
+                lines.append(f'convert_to_png_stage_{metric}{{stage="{stage}"}} {stats[field]}')
+        lines.append("# TYPE convert_to_png_gauge gauge")
+        for name, values in summary["gauges"].items():
+            lines.append(f'convert_to_png_gauge{{name="{name}"}} {values["current"]}')
+            lines.append(f'convert_to_png_gauge_max{{name="{name}"}} {values["max"]}')
+        lines.append(f"convert_to_png_elapsed_seconds {summary['elapsed_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            if path.endswith((".prom", ".txt")):
+                f.write(self.to_prometheus())
             else:
-                image_urls.extend(extract_image_urls(value))
-    elif isinstance(obj, list):
-        for item in obj:
-            image_urls.extend(extract_image_urls(item))
-    return image_urls
+                json.dump(self.summary(), f, indent=4)
+        logger.info("Metrics saved to %s", path)
 
 
-def main(json_input, download_folder):
-    if not os.path.exists(download_folder):
-        os.makedirs(download_folder)
+METRICS = Metrics()
 
-    image_urls = extract_image_urls(json_input)
-    url_mapping = {}
 
+@contextlib.contextmanager
+def profiling(profile_path=None, trace_memory=False):
+    profiler = cProfile.Profile() if profile_path else None
+    thread_profilers = []
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        sys.setprofile(None)
+        thread_profiler = cProfile.Profile()
+        try:
+            thread_profiler.enable()
+        except ValueError:
+            return
+        with lock:
+            thread_profilers.append(thread_profiler)
+
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+        threading.setprofile(profile_thread)
+    try:
+        yield
+    finally:
+        if profiler:
+            threading.setprofile(None)
+            profiler.disable()
+            stats = pstats.Stats(profiler)
+            with lock:
+                for thread_profiler in thread_profilers:
+                    stats.add(thread_profiler)
+            stats.dump_stats(profile_path)
+            logger.info("Profile of %d threads saved to %s", len(thread_profilers) + 1, profile_path)
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+            tracemalloc.stop()
+            logger.info("Traced memory: current %d bytes, peak %d bytes", current, peak)
+            for stat in top:
+                logger.info("  %s", stat)
+
+
+_STAGE_DONE = object()
+
+
+def _run_stage(func, in_queue, out_queue, workers, on_result=None, on_drop=None):
+    def worker():
+        while True:
+            item = in_queue.get()
+            if item is _STAGE_DONE:
+                in_queue.put(_STAGE_DONE)
+                return
+            url, value = item
+            try:
+                result = func(value)
+            except Exception as e:
+                logger.warning("Failed to process %s: %s", url, e)
+                result = None
+            if not result:
+                if on_drop:
+                    on_drop(url)
+                continue
+            if out_queue is not None:
+                out_queue.put((url, result))
+            if on_result:
+                on_result(url, result)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def _finish_stage(threads, out_queue):
+    for t in threads:
+        t.join()
+    if out_queue is not None:
+        out_queue.put(_STAGE_DONE)
+
+
+class ConvertPool:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown()
+
+    def _restart(self, executor):
+        with self.lock:
+            if self.executor is executor:
+                logger.warning("A conversion process died, restarting the conversion pool")
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        executor.shutdown(wait=False)
+
+    @staticmethod
+    def _run_isolated(func, *args):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return executor.submit(func, *args).result()
+
+    def run(self, func, *args):
+        executor = self.executor
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool:
+            self._restart(executor)
+        return self._run_isolated(func, *args)
+
+    async def run_async(self, func, *args):
+        executor = self.executor
+        try:
+            return await asyncio.wrap_future(executor.submit(func, *args))
+        except BrokenProcessPool:
+            self._restart(executor)
+        return await asyncio.to_thread(self._run_isolated, func, *args)
+
+
+def _convert_pool(convert_pool, convert_workers):
+    if convert_pool:
+        return contextlib.nullcontext(convert_pool)
+    return ConvertPool(convert_workers)
+
+
+@contextlib.contextmanager
+def shared_convert_pool(engine, engine_options):
+    if engine == "serial" or engine_options.get("convert_pool"):
+        yield engine_options
+        return
+    with ConvertPool(engine_options.get("convert_workers") or os.cpu_count() or 1) as pool:
+        yield dict(engine_options, convert_pool=pool)
+
+
+def run_pipeline(image_urls, download_folder, download_workers=8, convert_workers=None,
+                 upload_workers=8, queue_size=64, cache=None, spool_size=None, on_result=None, on_done=None,
+                 convert_options=None, upload_options=None, download_options=None, convert_pool=None):
+    convert_workers = convert_workers or os.cpu_count() or 1
+    download_queue = queue.Queue(maxsize=queue_size)
+    convert_queue = queue.Queue(maxsize=queue_size)
+    upload_queue = queue.Queue(maxsize=queue_size)
+
+    queues = {"download_queue": download_queue, "convert_queue": convert_queue, "upload_queue": upload_queue}
+    sampling = threading.Event()
+
+    def sample_queues():
+        while not sampling.wait(0.1):
+            for name, stage_queue in queues.items():
+                METRICS.gauge(name, stage_queue.qsize())
+
+    sampler = threading.Thread(target=sample_queues, daemon=True)
+    sampler.start()
+
+    def uploaded(url, firebase_url):
+        if on_result:
+            on_result(url, firebase_url)
+        if on_done:
+            on_done(url, firebase_url)
+
+    def dropped(url):
+        if on_done:
+            on_done(url, None)
+
+    with _convert_pool(convert_pool, convert_workers) as pool:
+        def convert(image_path):
+            return pool.run(functools.partial(convert_image_to_png, **(convert_options or {})), image_path)
+
+        download = METRICS.timed("download", _download_func(download_folder, cache, spool_size, download_options))
+        upload = METRICS.timed("upload", functools.partial(upload_image_to_firebase, **(upload_options or {})))
+        stages = [
+            (_run_stage(download, download_queue, convert_queue, download_workers, on_drop=dropped), convert_queue),
+            (_run_stage(METRICS.timed("convert", convert), convert_queue, upload_queue, convert_workers,
+                        on_drop=dropped), upload_queue),
+            (_run_stage(upload, upload_queue, None, upload_workers, uploaded, dropped), None),
+        ]
+
+        for url in image_urls:
+            download_queue.put((url, url))
+        download_queue.put(_STAGE_DONE)
+
+        for threads, out_queue in stages:
+            _finish_stage(threads, out_queue)
+    sampling.set()
+    sampler.join()
+
+
+async def download_image_async(session, url, folder, cache=None, spool_size=None, timeout=DEFAULT_TIMEOUT,
+                               retries=3, backoff=0.5, max_bytes=MAX_DOWNLOAD_BYTES):
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    validators, cached_url = await asyncio.to_thread(_conditional_headers, url, cache)
+
+    async def attempt():
+        buffer = ImageBuffer(_url_filename(url), folder, float('inf') if spool_size is None else spool_size)
+        return await _stream_download_async(session, url, buffer, validators, client_timeout, max_bytes)
+
+    try:
+        stream, headers = await with_retries_async(urlparse(url).netloc, attempt, retries, backoff)
+        if stream is None and cached_url:
+            return _not_modified(url, cached_url)
+        if spool_size is None:
+            return await asyncio.to_thread(_store_download, url, stream, headers, cache)
+        return await asyncio.to_thread(_finish_download, url, stream, headers, cache)
+    except Exception as e:
+        logger.warning("Failed to download %s: %s", url, e)
+        return None
+
+
+async def _stream_download_async(session, url, buffer, validators, client_timeout, max_bytes):
+    stream = DownloadStream(url, buffer, max_bytes)
+    try:
+        async with session.get(url, headers=validators, timeout=client_timeout) as response:
+            _check_status(response.status, response.headers, url)
+            response.raise_for_status()
+            if response.status == 304:
+                return None, response.headers
+            stream.check_headers(response.headers)
+            async for chunk in response.content.iter_chunked(1 << 16):
+                stream.write(chunk)
+        return stream.finish(), response.headers
+    except BaseException:
+        stream.discard()
+        raise
+
+
+def _timed_call(func, value):
+    start = time.perf_counter()
+    result = func(value)
+    return result, time.perf_counter() - start
+
+
+async def _process_url_async(session, url, limit, convert_pool, upload_pool, download, convert, upload):
+    try:
+        return url, await _process_image_async(session, url, limit, convert_pool, upload_pool, download, convert,
+                                               upload)
+    except Exception as e:
+        logger.warning("Failed to process %s: %s", url, e)
+        return url, None
+
+
+async def _process_image_async(session, url, limit, convert_pool, upload_pool, download, convert, upload):
+    loop = asyncio.get_running_loop()
+    async with limit:
+        METRICS.adjust("async_in_flight", 1)
+        start = time.perf_counter()
+        image_path = await download(session, url)
+        METRICS.observe("download", time.perf_counter() - start, url, image_path)
+        METRICS.adjust("async_in_flight", -1)
+    if not image_path:
+        return None
+    try:
+        png_path, elapsed = await convert_pool.run_async(_timed_call, convert, image_path)
+    except Exception:
+        METRICS.observe("convert", 0.0, image_path, None)
+        raise
+    METRICS.observe("convert", elapsed, image_path, png_path)
+    if not png_path:
+        return None
+    return await loop.run_in_executor(upload_pool, upload, png_path)
+
+
+async def run_async_engine_coro(image_urls, download_folder, concurrency=1000, per_host=100,
+                                convert_workers=None, upload_workers=32, queue_size=64, cache=None, spool_size=None,
+                                on_result=None, on_done=None, convert_options=None, upload_options=None,
+                                download_options=None, convert_pool=None):
+    convert_workers = convert_workers or os.cpu_count() or 1
+    download = functools.partial(download_image_async, folder=download_folder, cache=cache, spool_size=spool_size,
+                                 **(download_options or {}))
+    convert = functools.partial(convert_image_to_png, **(convert_options or {}))
+    upload = METRICS.timed("upload", functools.partial(upload_image_to_firebase, storage=get_storage(),
+                                                       **(upload_options or {})))
+    limit = asyncio.Semaphore(concurrency)
+    in_flight = asyncio.Semaphore(concurrency + queue_size)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+
+    urls = iter(image_urls)
+    tasks = set()
+
+    def finished(task):
+        tasks.discard(task)
+        in_flight.release()
+        url, firebase_url = task.result()
+        if firebase_url and on_result:
+            on_result(url, firebase_url)
+        if on_done:
+            on_done(url, firebase_url)
+
+    with _convert_pool(convert_pool, convert_workers) as convert_pool, \
+            ThreadPoolExecutor(max_workers=upload_workers) as upload_pool:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            while True:
+                await in_flight.acquire()
+                url = await asyncio.to_thread(next, urls, None)
+                if url is None:
+                    break
+                task = asyncio.create_task(_process_url_async(session, url, limit, convert_pool, upload_pool,
+                                                              download, convert, upload))
+                tasks.add(task)
+                task.add_done_callback(finished)
+            if tasks:
+                await asyncio.wait(tasks)
+
+
+def run_async_engine(image_urls, download_folder, **options):
+    return asyncio.run(run_async_engine_coro(image_urls, download_folder, **options))
+
+
+def run_serial(image_urls, download_folder, cache=None, spool_size=None, on_result=None, on_done=None,
+               convert_options=None, upload_options=None, download_options=None):
+    download = METRICS.timed("download", _download_func(download_folder, cache, spool_size, download_options))
+    convert = METRICS.timed("convert", functools.partial(convert_image_to_png, **(convert_options or {})))
+    upload = METRICS.timed("upload", functools.partial(upload_image_to_firebase, **(upload_options or {})))
     for url in image_urls:
-        image_path = download_image(url, download_folder)
+        firebase_url = None
+        image_path = download(url)
         if image_path:
-            png_path = convert_image_to_png(image_path)
+            png_path = convert(image_path)
             if png_path:
-                firebase_url = upload_image_to_firebase(png_path)
-                if firebase_url:
-                    url_mapping[url] = firebase_url
+                firebase_url = upload(png_path)
+                if firebase_url and on_result:
+                    on_result(url, firebase_url)
+        if on_done:
+            on_done(url, firebase_url)
+
+
+ENGINES = {
+    "serial": run_serial,
+    "pipeline": run_pipeline,
+    "async": run_async_engine,
+}
+
+
+class CheckpointJournal:
+    def __init__(self, path, resume=False, sync_interval=1.0, batch_size=1000):
+        self.completed = self.load(path) if resume else {}
+        self.file = open(path, 'a' if resume else 'w')
+        if self.file.tell() and not self._ends_with_newline(path):
+            self.file.write("\n")
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.syncer = threading.Thread(target=self._sync_loop, daemon=True)
+        self.syncer.start()
+        if resume:
+            logger.info("Resuming with %d completed images from %s", len(self.completed), path)
+
+    @staticmethod
+    def _ends_with_newline(path):
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    @staticmethod
+    def load(path):
+        completed = {}
+        if not os.path.exists(path):
+            return completed
+        with open(path) as f:
+            for line in f:
+                try:
+                    url, firebase_url = json.loads(line)
+                except ValueError:
+                    continue
+                completed[url] = firebase_url
+        return completed
+
+    def replay(self, image_urls):
+        return {url: self.completed[url] for url in image_urls if url in self.completed}
+
+    def record(self, url, firebase_url):
+        line = json.dumps([url, firebase_url]) + "\n"
+        with self.lock:
+            self.pending.append(line)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wake.set()
+
+    def _flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        self.file.write("".join(pending))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _sync_loop(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.sync_interval)
+            self.wake.clear()
+            self._flush()
+        self._flush()
+
+    def close(self):
+        self.stopped.set()
+        self.wake.set()
+        self.syncer.join()
+        self.file.close()
+
+
+class WorkQueue:
+    def __init__(self, path, lease_seconds=300, max_attempts=5, flush_interval=1.0):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.flush_interval = flush_interval
+        self.completed = []
+        self.completed_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "url TEXT PRIMARY KEY, status TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_expires REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, firebase_url TEXT, updated_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def enqueue(self, urls):
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT INTO tasks (url, updated_at) VALUES (?, ?) ON CONFLICT (url) DO UPDATE SET "
+                             "status = 'pending', attempts = 0, updated_at = excluded.updated_at "
+                             "WHERE tasks.status = 'failed'",
+                             [(url, now) for url in urls])
+            return conn.total_changes - before
+
+    def seal(self, sealed=True):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sealed', ?)", ("1" if sealed else "0",))
+
+    def claim(self, worker, limit):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE tasks SET status = 'failed', worker = NULL, updated_at = ? "
+                         "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            urls = [row[0] for row in conn.execute(
+                "SELECT url FROM tasks WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                "LIMIT ?", (now, limit)
+            )]
+            conn.executemany("UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, "
+                             "attempts = attempts + 1, updated_at = ? WHERE url = ?",
+                             [(worker, now + self.lease_seconds, now, url) for url in urls])
+        return urls
+
+    def renew(self, worker, urls):
+        expires = time.time() + self.lease_seconds
+        with self._transaction() as conn:
+            conn.executemany("UPDATE tasks SET lease_expires = ? WHERE url = ? AND worker = ? AND status = 'leased'",
+                             [(expires, url, worker) for url in urls])
+
+    @contextlib.contextmanager
+    def hold(self, worker, urls):
+        stopped = threading.Event()
+
+        def heartbeat():
+            renew_at = time.monotonic() + self.lease_seconds / 3
+            while not stopped.wait(min(self.flush_interval, self.lease_seconds / 3)):
+                self.flush()
+                if time.monotonic() >= renew_at:
+                    self.renew(worker, urls)
+                    renew_at = time.monotonic() + self.lease_seconds / 3
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+            self.flush()
+
+    def complete(self, url, firebase_url):
+        with self.completed_lock:
+            self.completed.append((_encode_mapping_value(firebase_url), url))
+
+    def flush(self):
+        with self.completed_lock:
+            completed, self.completed = self.completed, []
+        if not completed:
+            return
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("UPDATE tasks SET status = 'done', firebase_url = ?, lease_expires = NULL, "
+                             "updated_at = ? WHERE url = ? AND status != 'done'",
+                             [(firebase_url, now, url) for firebase_url, url in completed])
+
+    def fail(self, worker, urls):
+        with self._transaction() as conn:
+            conn.executemany("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                             "worker = NULL, lease_expires = NULL, updated_at = ? "
+                             "WHERE url = ? AND worker = ? AND status = 'leased'",
+                             [(self.max_attempts, time.time(), url, worker) for url in urls])
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def drained(self):
+        with self.lock:
+            sealed = self.conn.execute("SELECT value FROM meta WHERE key = 'sealed'").fetchone()
+            busy = self.conn.execute("SELECT 1 FROM tasks WHERE status IN ('pending', 'leased') LIMIT 1").fetchone()
+        return bool(sealed and sealed[0] == "1" and not busy)
+
+    def results(self, urls):
+        url_mapping = {}
+        urls = list(urls)
+        with self.lock:
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT url, firebase_url FROM tasks WHERE status = 'done' AND url IN "
+                    f"({', '.join('?' * len(chunk))})", chunk
+                )
+                url_mapping.update((url, _decode_mapping_value(firebase_url)) for url, firebase_url in rows)
+        return url_mapping
+
+    def close(self):
+        self.conn.close()
+
 
-    replace_urls_in_json(json_input, url_mapping)
+def in_shard(url, shard):
+    index, count = shard
+    return int(hashlib.sha1(url.encode()).hexdigest()[:8], 16) % count == index
 
-    with open('updated_json.json', 'w') as f:
+
+def process_urls(image_urls, download_folder, engine="serial", cache=None, journal=None, shard=None,
+                 **engine_options):
+    if shard:
+        image_urls = [url for url in image_urls if in_shard(url, shard)]
+    url_mapping = {}
+    if journal:
+        url_mapping.update(journal.replay(image_urls))
+        image_urls = [url for url in image_urls if url not in url_mapping]
+        engine_options['on_result'] = journal.record
+    if cache:
+        engine_options['cache'] = cache
+    new_mapping = {}
+
+    def collect(url, firebase_url):
+        if firebase_url:
+            new_mapping[url] = firebase_url
+
+    ENGINES[engine](image_urls, download_folder, on_done=collect, **engine_options)
+    if cache:
+        cache.record_uploads(new_mapping)
+    url_mapping.update(new_mapping)
+    return url_mapping
+
+
+def main(json_input, download_folder, engine="serial", cache_path=None, max_cache_bytes=None,
+         max_cache_age=None, journal_path=None, resume=False, image_keys=IMAGE_KEYS, selectors=(),
+         metrics_path=None, profile_path=None, trace_memory=False, storage=None, output_path='updated_json.json',
+         shard=None, **engine_options):
+    if not os.path.exists(download_folder):
+        os.makedirs(download_folder)
+    if storage:
+        set_storage(storage)
+    METRICS.reset()
+
+    image_fields = find_image_fields(json_input, image_keys, selectors)
+    image_urls = list(dict.fromkeys(field.url for field in image_fields))
+
+    with contextlib.ExitStack() as stack:
+        cache = open_cache(cache_path, engine_options)
+        if cache:
+            stack.callback(cache.close)
+        journal = CheckpointJournal(journal_path, resume) if journal_path else None
+        if journal:
+            stack.callback(journal.close)
+        with profiling(profile_path, trace_memory):
+            url_mapping = process_urls(image_urls, download_folder, engine, cache, journal, shard, **engine_options)
+
+    if max_cache_bytes is not None or max_cache_age is not None:
+        evict_downloads(download_folder, max_cache_bytes, max_cache_age)
+
+    replace_urls_in_json(json_input, url_mapping, image_fields)
+
+    with open(output_path, 'w') as f:
         json.dump(json_input, f, indent=4)
-    print("Updated JSON saved to updated_json.json")
+    logger.info("Updated JSON saved to %s", output_path)
+    if metrics_path:
+        METRICS.write(metrics_path)
+
+
+def iter_json_records(path, chunk_size=1 << 16):
+    f = open(path)
+    head = f.read(chunk_size)
+    if head.lstrip().startswith('['):
+        return "array", _iter_json_array(f, head, chunk_size)
+    head += f.readline()
+    try:
+        json.loads(head.lstrip().split("\n", 1)[0])
+    except ValueError:
+        return "document", _iter_json_document(f, head)
+    return "lines", _iter_json_lines(f, head)
+
+
+def _iter_json_document(f, head):
+    with f:
+        yield json.loads(head + f.read())
+
+
+def _iter_json_array(f, buffer, chunk_size):
+    decoder = json.JSONDecoder()
+    buffer = buffer.lstrip()[1:]
+    eof = False
+    with f:
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+                if end < len(buffer) or eof:
+                    yield record
+                    buffer = buffer[end:]
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+
+def _iter_json_lines(f, head):
+    with f:
+        for line in itertools.chain(head.splitlines(), f):
+            if line.strip():
+                yield json.loads(line)
+
+
+def main_streaming(input_path, download_folder, output_path='updated_json.json', engine="serial",
+                   batch_size=500, max_records=10000, mapping_size=100000, cache_path=None, max_cache_bytes=None,
+                   max_cache_age=None, journal_path=None, resume=False, image_keys=IMAGE_KEYS, selectors=(),
+                   metrics_path=None, profile_path=None, trace_memory=False, storage=None, shard=None,
+                   **engine_options):
+    if not os.path.exists(download_folder):
+        os.makedirs(download_folder)
+    if storage:
+        set_storage(storage)
+    METRICS.reset()
+
+    fmt, records = iter_json_records(input_path)
+    with contextlib.ExitStack() as stack:
+        cache = open_cache(cache_path, engine_options)
+        if cache:
+            stack.callback(cache.close)
+        journal = CheckpointJournal(journal_path, resume) if journal_path else None
+        if journal:
+            stack.callback(journal.close)
+        with profiling(profile_path, trace_memory), shared_convert_pool(engine, engine_options) as options:
+            records = process_records(records, download_folder, engine, cache, journal, shard, batch_size,
+                                      max_records, mapping_size, image_keys, selectors, **options)
+            with contextlib.closing(records):
+                write_json_records(output_path, records, fmt)
+
+    if max_cache_bytes is not None or max_cache_age is not None:
+        evict_downloads(download_folder, max_cache_bytes, max_cache_age)
+    logger.info("Updated JSON saved to %s", output_path)
+    if metrics_path:
+        METRICS.write(metrics_path)
+
+
+def process_records(records, download_folder, engine="serial", cache=None, journal=None, shard=None, window=500,
+                    max_records=10000, mapping_size=100000, image_keys=IMAGE_KEYS, selectors=(), **engine_options):
+    urls = queue.Queue()
+    finished = queue.Queue()
+    url_mapping = OrderedDict()
+    waiting = {}
+    pending = deque()
+    uploads = {}
+    if journal:
+        engine_options['on_result'] = journal.record
+    if cache:
+        engine_options['cache'] = cache
+
+    def on_done(url, firebase_url):
+        finished.put((url, firebase_url))
+
+    def remember(url, firebase_url):
+        url_mapping[url] = firebase_url
+        while len(url_mapping) > mapping_size:
+            url_mapping.popitem(last=False)
+
+    def resolve(block=True):
+        item = finished.get(block)
+        if item is _STAGE_DONE:
+            engine_run.result()
+            raise RuntimeError(f"the {engine} engine stopped before all images were processed")
+        url, firebase_url = item
+        remember(url, firebase_url)
+        if firebase_url:
+            uploads[url] = firebase_url
+        for entry in waiting.pop(url):
+            if firebase_url:
+                entry[2][url] = firebase_url
+            entry[3] -= 1
+        if cache and len(uploads) >= window:
+            cache.record_uploads(uploads)
+            uploads.clear()
+
+    def ready():
+        while pending and not pending[0][3]:
+            record, fields, mapping, _ = pending.popleft()
+            replace_urls_in_json(record, mapping, fields)
+            yield record
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    engine_run = executor.submit(ENGINES[engine], iter(urls.get, _STAGE_DONE), download_folder, on_done=on_done,
+                                 **engine_options)
+    engine_run.add_done_callback(lambda _: finished.put(_STAGE_DONE))
+    try:
+        for record in records:
+            fields = find_image_fields(record, image_keys, selectors)
+            entry = [record, fields, {}, 0]
+            for url in dict.fromkeys(field.url for field in fields):
+                if shard and not in_shard(url, shard):
+                    continue
+                if url in waiting:
+                    waiting[url].append(entry)
+                    entry[3] += 1
+                    continue
+                if url not in url_mapping and journal and url in journal.completed:
+                    remember(url, journal.completed[url])
+                if url in url_mapping:
+                    if url_mapping[url]:
+                        entry[2][url] = url_mapping[url]
+                    continue
+                waiting[url] = [entry]
+                entry[3] += 1
+                urls.put(url)
+            pending.append(entry)
+            while not finished.empty():
+                resolve(block=False)
+            yield from ready()
+            while len(waiting) >= window or len(pending) >= max_records:
+                resolve()
+                yield from ready()
+
+        urls.put(_STAGE_DONE)
+        while pending:
+            resolve()
+            yield from ready()
+        engine_run.result()
+    finally:
+        urls.put(_STAGE_DONE)
+        executor.shutdown()
+        if cache and uploads:
+            cache.record_uploads(uploads)
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_json_records(path, records, fmt="array"):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        if fmt == "lines":
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            return
+        if fmt == "document":
+            for record in records:
+                json.dump(record, f, indent=4)
+            return
+
+        first = True
+        for record in records:
+            f.write("[\n" if first else ",\n")
+            f.write(textwrap.indent(json.dumps(record, indent=4), "    "))
+            first = False
+        f.write("[]" if first else "\n]")
+
+
+def run_worker(queue_path, download_folder, engine="serial", batch_size=100, lease_seconds=300,
+               poll_interval=1.0, cache_path=None, metrics_path=None, storage=None, worker_id=None,
+               **engine_options):
+    if not os.path.exists(download_folder):
+        os.makedirs(download_folder, exist_ok=True)
+    if storage:
+        set_storage(storage)
+    METRICS.reset()
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    work_queue = WorkQueue(queue_path, lease_seconds)
+    cache = open_cache(cache_path, engine_options)
+    processed = 0
+
+    with contextlib.ExitStack() as stack:
+        stack.callback(work_queue.close)
+        if cache:
+            stack.callback(cache.close)
+        options = stack.enter_context(shared_convert_pool(engine, engine_options))
+        options = dict(options, on_result=work_queue.complete)
+        while True:
+            urls = work_queue.claim(worker_id, batch_size)
+            if not urls:
+                if work_queue.drained():
+                    break
+                time.sleep(poll_interval)
+                continue
+            with work_queue.hold(worker_id, urls):
+                url_mapping = process_urls(urls, download_folder, engine, cache, **options)
+            work_queue.fail(worker_id, [url for url in urls if url not in url_mapping])
+            processed += len(urls)
+            logger.info("Worker %s processed %d images", worker_id, processed)
+
+    if metrics_path:
+        METRICS.write(metrics_path)
+    return processed
+
+
+def run_coordinator(queue_path, jobs, batch_size=500, image_keys=IMAGE_KEYS, selectors=(), poll_interval=2.0,
+                    on_enqueued=None, workers_alive=None):
+    jobs = list(jobs)
+    work_queue = WorkQueue(queue_path)
+    work_queue.seal(False)
+    for job in jobs:
+        keys = tuple(job.get("image_keys") or image_keys)
+        _, records = iter_json_records(job["input"])
+        enqueued = 0
+        for batch in _batched(records, batch_size):
+            enqueued += work_queue.enqueue(dict.fromkeys(
+                url for record in batch for url in extract_image_urls(record, keys, job.get("selectors") or selectors)
+            ))
+        logger.info("Enqueued %d new images from %s", enqueued, job["input"])
+    work_queue.seal()
+    if on_enqueued:
+        on_enqueued()
+
+    while not work_queue.drained():
+        if workers_alive and not workers_alive():
+            if work_queue.drained():
+                break
+            work_queue.close()
+            raise RuntimeError("all workers exited before the queue was drained")
+        counts = work_queue.counts()
+        logger.info("Queue: %s", ", ".join(f"{counts.get(status, 0)} {status}"
+                                           for status in ("pending", "leased", "done", "failed")))
+        time.sleep(poll_interval)
+
+    for job in jobs:
+        keys = tuple(job.get("image_keys") or image_keys)
+        fmt, records = iter_json_records(job["input"])
+
+        def merged(records=records, keys=keys, job_selectors=job.get("selectors") or selectors):
+            for batch in _batched(records, batch_size):
+                batch_fields = [find_image_fields(record, keys, job_selectors) for record in batch]
+                url_mapping = work_queue.results(field.url for fields in batch_fields for field in fields)
+                for record, fields in zip(batch, batch_fields):
+                    replace_urls_in_json(record, url_mapping, fields)
+                    yield record
+
+        write_json_records(job["output"], merged(), fmt)
+        logger.info("Updated JSON saved to %s", job["output"])
+    counts = work_queue.counts()
+    work_queue.close()
+    return counts
+
+
+async def _head_image(session, url, validators, limit, timeout, retries, backoff):
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+
+    async def attempt():
+        async with session.head(url, headers=validators, timeout=client_timeout, allow_redirects=True) as response:
+            _check_status(response.status, response.headers, url)
+            return response.status, response.headers
+
+    async with limit:
+        try:
+            return url, *await with_retries_async(urlparse(url).netloc, attempt, retries, backoff)
+        except Exception as e:
+            logger.warning("Failed to check %s: %s", url, e)
+            return url, None, {}
+
+
+async def _head_images(conditional, concurrency, per_host, timeout, retries, backoff):
+    limit = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [_head_image(session, url, validators, limit, timeout, retries, backoff)
+                 for url, validators in conditional.items()]
+        return [await task for task in asyncio.as_completed(tasks)]
+
+
+def _classify(url, status, headers, cached, max_bytes, fingerprint):
+    if status is None:
+        return "failed"
+    if status == 304:
+        return "cached"
+    if status not in (405, 501):
+        if status >= 400:
+            return "failed"
+        try:
+            DownloadStream(url, None, max_bytes).check_headers(headers)
+        except RejectedDownload:
+            return "rejected"
+    if not cached or not cached["firebase_url"]:
+        return "new"
+    if cached["fingerprint"] != fingerprint:
+        return "changed"
+    if (cached["etag"] and cached["etag"] == headers.get('ETag')) or \
+            (cached["last_modified"] and cached["last_modified"] == headers.get('Last-Modified')):
+        return "cached"
+    return "changed"
+
+
+def planned_workers(engine="serial", engine_options=None, hosts=1):
+    if engine == "serial":
+        return {"download": 1, "convert": 1, "upload": 1}
+    runner = run_pipeline if engine == "pipeline" else run_async_engine_coro
+    options = {name: parameter.default for name, parameter in inspect.signature(runner).parameters.items()}
+    options.update(engine_options or {})
+    if engine == "pipeline":
+        download = options["download_workers"]
+    else:
+        download = min(options["concurrency"], options["per_host"] * max(hosts, 1))
+    convert = options["convert_workers"] or os.cpu_count() or 1
+    return {"download": download, "convert": convert, "upload": options["upload_workers"]}
+
+
+def estimate_runtime(counts, metrics_path, workers, engine="serial"):
+    with open(metrics_path) as f:
+        stages = json.load(f)["stages"]
+    changed = counts["new"] + counts["changed"]
+    estimate = {}
+    for stage in ("download", "convert", "upload"):
+        stats = stages.get(stage, {})
+        if not stats.get("work_count"):
+            continue
+        seconds = changed * stats["work_seconds"] / stats["work_count"]
+        if stage == "download" and stats.get("skipped_count"):
+            seconds += counts["cached"] * stats["skipped_seconds"] / stats["skipped_count"]
+        estimate[stage] = seconds / workers[stage]
+    if estimate:
+        estimate["total"] = sum(estimate.values()) if engine == "serial" else max(estimate.values())
+    return estimate
+
+
+def plan_catalogs(jobs, cache_path=None, metrics_path=None, concurrency=64, per_host=8, image_keys=IMAGE_KEYS,
+                  selectors=(), shard=None, batch_size=500, timeout=DEFAULT_TIMEOUT, retries=2, backoff=0.5,
+                  max_bytes=MAX_DOWNLOAD_BYTES, fingerprint=None, engine="serial", engine_options=None):
+    image_urls = {}
+    for job in jobs:
+        keys = tuple(job.get("image_keys") or image_keys)
+        _, records = iter_json_records(job["input"])
+        for batch in _batched(records, batch_size):
+            for record in batch:
+                image_urls.update(dict.fromkeys(extract_image_urls(record, keys, job.get("selectors") or selectors)))
+    if shard:
+        image_urls = {url: None for url in image_urls if in_shard(url, shard)}
+
+    cache = ImageCache(cache_path, fingerprint) if cache_path and os.path.exists(cache_path) else None
+    cached = {}
+    conditional = {}
+    for url in image_urls:
+        cached[url] = cache.get(url) if cache else None
+        conditional[url] = cache.validators(url)[0] if cache else {}
+    if cache:
+        cache.close()
+
+    start = time.perf_counter()
+    responses = asyncio.run(_head_images(conditional, concurrency, per_host, timeout, retries, backoff))
+    logger.info("Checked %d urls in %.1fs", len(responses), time.perf_counter() - start)
+
+    counts = dict.fromkeys(("new", "changed", "cached", "rejected", "failed"), 0)
+    content_types = Counter()
+    bytes_to_fetch = 0
+    unknown_sizes = 0
+    for url, status, headers in responses:
+        kind = _classify(url, status, headers, cached[url], max_bytes, fingerprint)
+        counts[kind] += 1
+        if kind not in ("new", "changed"):
+            continue
+        content_types[headers.get('Content-Type', 'unknown').split(';')[0]] += 1
+        length = headers.get('Content-Length', '')
+        if length.isdigit():
+            bytes_to_fetch += int(length)
+        else:
+            unknown_sizes += 1
+
+    workers = planned_workers(engine, engine_options, len({urlparse(url).netloc for url in image_urls}))
+    report = {
+        "images": len(image_urls),
+        **counts,
+        "bytes_to_fetch": bytes_to_fetch,
+        "unknown_sizes": unknown_sizes,
+        "content_types": dict(content_types.most_common()),
+        "workers": workers,
+        "estimated_seconds": estimate_runtime(counts, metrics_path, workers, engine) if metrics_path else None,
+    }
+    logger.info("%d images: %d new, %d changed, %d cached, %d rejected, %d failed, %.1f MB to fetch",
+                report["images"], counts["new"], counts["changed"], counts["cached"], counts["rejected"],
+                counts["failed"], bytes_to_fetch / (1 << 20))
+    return report
+
+
+def parse_shard(text):
+    index, _, count = text.partition("/")
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard must be i/n with 0 <= i < n, got {text!r}")
+    return index, count
+
+
+def parse_option(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the images referenced by JSON catalogs to PNG, upload them "
+                                                 "and write catalogs pointing at the uploaded images.")
+    parser.add_argument("inputs", nargs="*", help="catalog files or glob patterns (JSON array, JSON Lines or JSON document)")
+    parser.add_argument("-o", "--output", help="output path, only valid with a single input")
+    parser.add_argument("--output-dir", default="updated", help="folder for outputs when -o is not given")
+    parser.add_argument("--jobs", help="JSON Lines file of jobs, one {\"input\": ..., \"output\": ...} per line")
+    parser.add_argument("--download-folder", default="downloaded_images")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="serial")
+    parser.add_argument("--options", default="{}", help="JSON object of extra engine options")
+    parser.add_argument("--spool-size", type=int, help="convert in memory below this many bytes")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--image-key", action="append", dest="image_keys", help="image field name, repeatable")
+    parser.add_argument("--selector", action="append", dest="selectors", default=[], help="repeatable")
+    parser.add_argument("--shard", type=parse_shard, help="only process urls whose hash falls in shard i of n")
+    parser.add_argument("--storage", choices=sorted(STORAGE_BACKENDS), default="firebase")
+    parser.add_argument("--storage-option", action="append", type=parse_option, default=[], metavar="KEY=VALUE",
+                        help="storage backend argument, repeatable")
+    parser.add_argument("--credentials", default="serviceAccountKey.json", help="Firebase service account key")
+    parser.add_argument("--bucket", default='<Firebase Storage Bucket Url>', help="Firebase storage bucket")
+    parser.add_argument("--cache", dest="cache_path", help="SQLite cache path")
+    parser.add_argument("--max-cache-bytes", type=int)
+    parser.add_argument("--max-cache-age", type=float, help="seconds")
+    parser.add_argument("--journal", dest="journal_path", help="checkpoint journal path")
+    parser.add_argument("--resume", action="store_true", help="skip images already in the journal")
+    parser.add_argument("--metrics", dest="metrics_path",
+                        help="metrics output path, {name} is replaced by the catalog name")
+    parser.add_argument("--profile", dest="profile_path", help="write cProfile stats of all threads to this path")
+    parser.add_argument("--trace-memory", action="store_true", help="log tracemalloc peak usage and top allocations")
+    parser.add_argument("--queue", help="SQLite work queue shared by a coordinator and its workers")
+    parser.add_argument("--worker", action="store_true", help="process images from --queue instead of catalogs")
+    parser.add_argument("--local-workers", type=int, default=0, help="workers the coordinator starts itself")
+    parser.add_argument("--lease", type=float, default=300, help="seconds a worker holds claimed images")
+    parser.add_argument("--plan", action="store_true",
+                        help="only report what a run would fetch and how long it would take, without uploading")
+    parser.add_argument("--plan-metrics", help="JSON metrics file of an earlier run used to estimate the runtime")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO"))
+    args = parser.parse_args(argv)
+    if (args.worker or args.local_workers) and not args.queue:
+        parser.error("--worker and --local-workers need --queue")
+    if not args.inputs and not args.jobs and not args.worker:
+        parser.error("give at least one input or --jobs")
+    if args.output and (args.jobs or len(expand_inputs(args.inputs)) != 1):
+        parser.error("-o/--output needs exactly one input, use --output-dir for several")
+    try:
+        args.job_list = load_jobs(args)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            logger.warning("No files match %s", pattern)
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def load_jobs(args):
+    if args.worker:
+        return []
+    if args.jobs:
+        with open(args.jobs) as f:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    else:
+        jobs = [{"input": path, "output": args.output} for path in expand_inputs(args.inputs)]
+    for job in jobs:
+        if not job.get("output"):
+            job["output"] = os.path.join(args.output_dir, os.path.basename(job["input"]))
+    if not args.plan:
+        check_outputs(jobs)
+    return jobs
+
+
+def check_outputs(jobs):
+    inputs = {os.path.realpath(job["input"]) for job in jobs}
+    outputs = {}
+    for job in jobs:
+        output = os.path.realpath(job["output"])
+        if output in inputs:
+            raise ValueError(f"output {job['output']} would overwrite an input")
+        if output in outputs:
+            raise ValueError(f"{outputs[output]} and {job['input']} would both be written to {job['output']}")
+        outputs[output] = job["input"]
+
+
+def make_storage(args):
+    if args.storage == "firebase":
+        initialize_firebase(args.credentials, args.bucket)
+    return STORAGE_BACKENDS[args.storage](**dict(args.storage_option))
+
+
+def _engine_options(args):
+    engine_options = json.loads(args.options)
+    if args.spool_size is not None:
+        engine_options["spool_size"] = args.spool_size
+    return engine_options
+
+
+def run_cli_worker(args):
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+    run_worker(args.queue, args.download_folder, args.engine, args.batch_size, args.lease,
+               cache_path=args.cache_path, metrics_path=args.metrics_path and args.metrics_path.format(name="worker"),
+               storage=make_storage(args), **_engine_options(args))
+    return 0
+
+
+def run_cli_coordinator(args):
+    workers = [multiprocessing.Process(target=run_cli_worker, args=(args,)) for _ in range(args.local_workers)]
+
+    def start_workers():
+        for worker in workers:
+            worker.start()
+
+    def workers_alive():
+        return any(worker.is_alive() for worker in workers)
+
+    try:
+        counts = run_coordinator(args.queue, args.job_list, args.batch_size, tuple(args.image_keys or IMAGE_KEYS),
+                                 tuple(args.selectors), on_enqueued=start_workers,
+                                 workers_alive=workers_alive if workers else None)
+    except RuntimeError as e:
+        logger.error("%s, exit codes: %s", e, ", ".join(str(worker.exitcode) for worker in workers))
+        return 1
+    for worker in workers:
+        worker.join()
+    return 1 if counts.get("failed") else 0
+
+
+def run_cli_plan(args):
+    options = json.loads(args.options)
+    download_options = options.get("download_options", {})
+    storage = STORAGE_BACKENDS[args.storage](**dict(args.storage_option))
+    report = plan_catalogs(args.job_list, args.cache_path, args.plan_metrics,
+                           options.get("concurrency", 64), options.get("per_host", 8),
+                           tuple(args.image_keys or IMAGE_KEYS), tuple(args.selectors), args.shard, args.batch_size,
+                           max_bytes=download_options.get("max_bytes", MAX_DOWNLOAD_BYTES),
+                           fingerprint=output_fingerprint(storage, options.get("convert_options"),
+                                                          options.get("upload_options")),
+                           engine=args.engine, engine_options=options)
+    print(json.dumps(report, indent=4))
+    return 0
+
+
+def run_cli(args):
+    if args.plan:
+        return run_cli_plan(args)
+    if args.worker:
+        return run_cli_worker(args)
+    if args.queue:
+        return run_cli_coordinator(args)
+    engine_options = _engine_options(args)
+    storage = make_storage(args)
+    resume = args.resume
+    failed = 0
+    with shared_convert_pool(args.engine, engine_options) as options:
+        for job in args.job_list:
+            name = os.path.splitext(os.path.basename(job["input"]))[0]
+            try:
+                main_streaming(job["input"], args.download_folder, job["output"], args.engine,
+                               batch_size=args.batch_size, cache_path=args.cache_path,
+                               max_cache_bytes=args.max_cache_bytes, max_cache_age=args.max_cache_age,
+                               journal_path=args.journal_path, resume=resume,
+                               image_keys=tuple(job.get("image_keys") or args.image_keys or IMAGE_KEYS),
+                               selectors=tuple(job.get("selectors") or args.selectors),
+                               metrics_path=args.metrics_path and args.metrics_path.format(name=name),
+                               profile_path=args.profile_path, trace_memory=args.trace_memory, storage=storage,
+                               shard=args.shard, **options)
+            except Exception as e:
+                logger.error("Failed to process %s: %s", job["input"], e)
+                failed += 1
+            resume = True
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    json_input = """
-                                   [
-                                     {
-                                       "id": 1,
-                                       "title": "Fjallraven - Foldsack No. 1 Backpack, Fits 15 Laptops",
-                                       "price": 109.95,
-                                       "description": "Your perfect pack for everyday use and walks in the forest. Stash your laptop (up to 15 inches) in the padded sleeve, your everyday",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/81fPKd-2AYL._AC_SL1500_.jpg",
-                                       "rating": {
-                                         "rate": 3.9,
-                                         "count": 120
-                                       }
-                                     },
-                                     {
-                                       "id": 2,
-                                       "title": "Mens Casual Premium Slim Fit T-Shirts ",
-                                       "price": 22.3,
-                                       "description": "Slim-fitting style, contrast raglan long sleeve, three-button henley placket, light weight & soft fabric for breathable and comfortable wearing. And Solid stitched shirts with round neck made for durability and a great fit for casual fashion wear and diehard baseball fans. The Henley style round neckline includes a three-button placket.",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/71-3HjGNDUL._AC_SY879._SX._UX._SY._UY_.jpg",
-                                       "rating": {
-                                         "rate": 4.1,
-                                         "count": 259
-                                       }
-                                     },
-                                     {
-                                       "id": 3,
-                                       "title": "Mens Cotton Jacket",
-                                       "price": 55.99,
-                                       "description": "great outerwear jackets for Spring/Autumn/Winter, suitable for many occasions, such as working, hiking, camping, mountain/rock climbing, cycling, traveling or other outdoors. Good gift choice for you or your family member. A warm hearted love to Father, husband or son in this thanksgiving or Christmas Day.",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/71li-ujtlUL._AC_UX679_.jpg",
-                                       "rating": {
-                                         "rate": 4.7,
-                                         "count": 500
-                                       }
-                                     },
-                                     {
-                                       "id": 4,
-                                       "title": "Mens Casual Slim Fit",
-                                       "price": 15.99,
-                                       "description": "The color could be slightly different between on the screen and in practice. / Please note that body builds vary by person, therefore, detailed size information should be reviewed below on the product description.",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/71YXzeOuslL._AC_UY879_.jpg",
-                                       "rating": {
-                                         "rate": 2.1,
-                                         "count": 430
-                                       }
-                                     },
-                                     {
-                                       "id": 5,
-                                       "title": "John Hardy Women's Legends Naga Gold & Silver Dragon Station Chain Bracelet",
-                                       "price": 695,
-                                       "description": "From our Legends Collection, the Naga was inspired by the mythical water dragon that protects the ocean's pearl. Wear facing inward to be bestowed with love and abundance, or outward for protection.",
-                                       "category": "jewelery",
-                                       "image": "https://fakestoreapi.com/img/71pWzhdJNwL._AC_UL640_QL65_ML3_.jpg",
-                                       "rating": {
-                                         "rate": 4.6,
-                                         "count": 400
-                                       }
-                                     },
-                                     {
-                                       "id": 6,
-                                       "title": "Solid Gold Petite Micropave ",
-                                       "price": 168,
-                                       "description": "Satisfaction Guaranteed. Return or exchange any order within 30 days.Designed and sold by Hafeez Center in the United States. Satisfaction Guaranteed. Return or exchange any order within 30 days.",
-                                       "category": "jewelery",
-                                       "image": "https://fakestoreapi.com/img/61sbMiUnoGL._AC_UL640_QL65_ML3_.jpg",
-                                       "rating": {
-                                         "rate": 3.9,
-                                         "count": 70
-                                       }
-                                     },
-                                     {
-                                       "id": 7,
-                                       "title": "White Gold Plated Princess",
-                                       "price": 9.99,
-                                       "description": "Classic Created Wedding Engagement Solitaire Diamond Promise Ring for Her. Gifts to spoil your love more for Engagement, Wedding, Anniversary, Valentine's Day...",
-                                       "category": "jewelery",
-                                       "image": "https://fakestoreapi.com/img/71YAIFU48IL._AC_UL640_QL65_ML3_.jpg",
-                                       "rating": {
-                                         "rate": 3,
-                                         "count": 400
-                                       }
-                                     },
-                                     {
-                                       "id": 8,
-                                       "title": "Pierced Owl Rose Gold Plated Stainless Steel Double",
-                                       "price": 10.99,
-                                       "description": "Rose Gold Plated Double Flared Tunnel Plug Earrings. Made of 316L Stainless Steel",
-                                       "category": "jewelery",
-                                       "image": "https://fakestoreapi.com/img/51UDEzMJVpL._AC_UL640_QL65_ML3_.jpg",
-                                       "rating": {
-                                         "rate": 1.9,
-                                         "count": 100
-                                       }
-                                     },
-                                     {
-                                       "id": 9,
-                                       "title": "WD 2TB Elements Portable External Hard Drive - USB 3.0 ",
-                                       "price": 64,
-                                       "description": "USB 3.0 and USB 2.0 Compatibility Fast data transfers Improve PC Performance High Capacity; Compatibility Formatted NTFS for Windows 10, Windows 8.1, Windows 7; Reformatting may be required for other operating systems; Compatibility may vary depending on user’s hardware configuration and operating system",
-                                       "category": "electronics",
-                                       "image": "https://fakestoreapi.com/img/61IBBVJvSDL._AC_SY879_.jpg",
-                                       "rating": {
-                                         "rate": 3.3,
-                                         "count": 203
-                                       }
-                                     },
-                                     {
-                                       "id": 10,
-                                       "title": "SanDisk SSD PLUS 1TB Internal SSD - SATA III 6 Gb/s",
-                                       "price": 109,
-                                       "description": "Easy upgrade for faster boot up, shutdown, application load and response (As compared to 5400 RPM SATA 2.5” hard drive; Based on published specifications and internal benchmarking tests using PCMark vantage scores) Boosts burst write performance, making it ideal for typical PC workloads The perfect balance of performance and reliability Read/write speeds of up to 535MB/s/450MB/s (Based on internal testing; Performance may vary depending upon drive capacity, host device, OS and application.)",
-                                       "category": "electronics",
-                                       "image": "https://fakestoreapi.com/img/61U7T1koQqL._AC_SX679_.jpg",
-                                       "rating": {
-                                         "rate": 2.9,
-                                         "count": 470
-                                       }
-                                     },
-                                     {
-                                       "id": 11,
-                                       "title": "Silicon Power 256GB SSD 3D NAND A55 SLC Cache Performance Boost SATA III 2.5",
-                                       "price": 109,
-                                       "description": "3D NAND flash are applied to deliver high transfer speeds Remarkable transfer speeds that enable faster bootup and improved overall system performance. The advanced SLC Cache Technology allows performance boost and longer lifespan 7mm slim design suitable for Ultrabooks and Ultra-slim notebooks. Supports TRIM command, Garbage Collection technology, RAID, and ECC (Error Checking & Correction) to provide the optimized performance and enhanced reliability.",
-                                       "category": "electronics",
-                                       "image": "https://fakestoreapi.com/img/71kWymZ+c+L._AC_SX679_.jpg",
-                                       "rating": {
-                                         "rate": 4.8,
-                                         "count": 319
-                                       }
-                                     },
-                                     {
-                                       "id": 12,
-                                       "title": "WD 4TB Gaming Drive Works with Playstation 4 Portable External Hard Drive",
-                                       "price": 114,
-                                       "description": "Expand your PS4 gaming experience, Play anywhere Fast and easy, setup Sleek design with high capacity, 3-year manufacturer's limited warranty",
-                                       "category": "electronics",
-                                       "image": "https://fakestoreapi.com/img/61mtL65D4cL._AC_SX679_.jpg",
-                                       "rating": {
-                                         "rate": 4.8,
-                                         "count": 400
-                                       }
-                                     },
-                                     {
-                                       "id": 13,
-                                       "title": "Acer SB220Q bi 21.5 inches Full HD (1920 x 1080) IPS Ultra-Thin",
-                                       "price": 599,
-                                       "description": "21. 5 inches Full HD (1920 x 1080) widescreen IPS display And Radeon free Sync technology. No compatibility for VESA Mount Refresh Rate: 75Hz - Using HDMI port Zero-frame design | ultra-thin | 4ms response time | IPS panel Aspect ratio - 16: 9. Color Supported - 16. 7 million colors. Brightness - 250 nit Tilt angle -5 degree to 15 degree. Horizontal viewing angle-178 degree. Vertical viewing angle-178 degree 75 hertz",
-                                       "category": "electronics",
-                                       "image": "https://fakestoreapi.com/img/81QpkIctqPL._AC_SX679_.jpg",
-                                       "rating": {
-                                         "rate": 2.9,
-                                         "count": 250
-                                       }
-                                     },
-                                     {
-                                       "id": 14,
-                                       "title": "Samsung 49-Inch CHG90 144Hz Curved Gaming Monitor (LC49HG90DMNXZA) – Super Ultrawide Screen QLED ",
-                                       "price": 999.99,
-                                       "description": "49 INCH SUPER ULTRAWIDE 32:9 CURVED GAMING MONITOR with dual 27 inch screen side by side QUANTUM DOT (QLED) TECHNOLOGY, HDR support and factory calibration provides stunningly realistic and accurate color and contrast 144HZ HIGH REFRESH RATE and 1ms ultra fast response time work to eliminate motion blur, ghosting, and reduce input lag",
-                                       "category": "electronics",
-                                       "image": "https://fakestoreapi.com/img/81Zt42ioCgL._AC_SX679_.jpg",
-                                       "rating": {
-                                         "rate": 2.2,
-                                         "count": 140
-                                       }
-                                     },
-                                     {
-                                       "id": 15,
-                                       "title": "BIYLACLESEN Women's 3-in-1 Snowboard Jacket Winter Coats",
-                                       "price": 56.99,
-                                       "description": "Note:The Jackets is US standard size, Please choose size as your usual wear Material: 100% Polyester; Detachable Liner Fabric: Warm Fleece. Detachable Functional Liner: Skin Friendly, Lightweigt and Warm.Stand Collar Liner jacket, keep you warm in cold weather. Zippered Pockets: 2 Zippered Hand Pockets, 2 Zippered Pockets on Chest (enough to keep cards or keys)and 1 Hidden Pocket Inside.Zippered Hand Pockets and Hidden Pocket keep your things secure. Humanized Design: Adjustable and Detachable Hood and Adjustable cuff to prevent the wind and water,for a comfortable fit. 3 in 1 Detachable Design provide more convenience, you can separate the coat and inner as needed, or wear it together. It is suitable for different season and help you adapt to different climates",
-                                       "category": "women's clothing",
-                                       "image": "https://fakestoreapi.com/img/51Y5NI-I5jL._AC_UX679_.jpg",
-                                       "rating": {
-                                         "rate": 2.6,
-                                         "count": 235
-                                       }
-                                     },
-                                     {
-                                       "id": 16,
-                                       "title": "Lock and Love Women's Removable Hooded Faux Leather Moto Biker Jacket",
-                                       "price": 29.95,
-                                       "description": "100% POLYURETHANE(shell) 100% POLYESTER(lining) 75% POLYESTER 25% COTTON (SWEATER), Faux leather material for style and comfort / 2 pockets of front, 2-For-One Hooded denim style faux leather jacket, Button detail on waist / Detail stitching at sides, HAND WASH ONLY / DO NOT BLEACH / LINE DRY / DO NOT IRON",
-                                       "category": "women's clothing",
-                                       "image": "https://fakestoreapi.com/img/81XH0e8fefL._AC_UY879_.jpg",
-                                       "rating": {
-                                         "rate": 2.9,
-                                         "count": 340
-                                       }
-                                     },
-                                     {
-                                       "id": 17,
-                                       "title": "Rain Jacket Women Windbreaker Striped Climbing Raincoats",
-                                       "price": 39.99,
-                                       "description": "Lightweight perfet for trip or casual wear---Long sleeve with hooded, adjustable drawstring waist design. Button and zipper front closure raincoat, fully stripes Lined and The Raincoat has 2 side pockets are a good size to hold all kinds of things, it covers the hips, and the hood is generous but doesn't overdo it.Attached Cotton Lined Hood with Adjustable Drawstrings give it a real styled look.",
-                                       "category": "women's clothing",
-                                       "image": "https://fakestoreapi.com/img/71HblAHs5xL._AC_UY879_-2.jpg",
-                                       "rating": {
-                                         "rate": 3.8,
-                                         "count": 679
-                                       }
-                                     },
-                                     {
-                                       "id": 18,
-                                       "title": "MBJ Women's Solid Short Sleeve Boat Neck V ",
-                                       "price": 9.85,
-                                       "description": "95% RAYON 5% SPANDEX, Made in USA or Imported, Do Not Bleach, Lightweight fabric with great stretch for comfort, Ribbed on sleeves and neckline / Double stitching on bottom hem",
-                                       "category": "women's clothing",
-                                       "image": "https://fakestoreapi.com/img/71z3kpMAYsL._AC_UY879_.jpg",
-                                       "rating": {
-                                         "rate": 4.7,
-                                         "count": 130
-                                       }
-                                     },
-                                     {
-                                       "id": 19,
-                                       "title": "Opna Women's Short Sleeve Moisture",
-                                       "price": 7.95,
-                                       "description": "100% Polyester, Machine wash, 100% cationic polyester interlock, Machine Wash & Pre Shrunk for a Great Fit, Lightweight, roomy and highly breathable with moisture wicking fabric which helps to keep moisture away, Soft Lightweight Fabric with comfortable V-neck collar and a slimmer fit, delivers a sleek, more feminine silhouette and Added Comfort",
-                                       "category": "women's clothing",
-                                       "image": "https://fakestoreapi.com/img/51eg55uWmdL._AC_UX679_.jpg",
-                                       "rating": {
-                                         "rate": 4.5,
-                                         "count": 146
-                                       }
-                                     },
-                                     {
-                                       "id": 20,
-                                       "title": "DANVOUY Womens T Shirt Casual Cotton Short",
-                                       "price": 12.99,
-                                       "description": "95%Cotton,5%Spandex, Features: Casual, Short Sleeve, Letter Print,V-Neck,Fashion Tees, The fabric is soft and has some stretch., Occasion: Casual/Office/Beach/School/Home/Street. Season: Spring,Summer,Autumn,Winter.",
-                                       "category": "women's clothing",
-                                       "image": "https://fakestoreapi.com/img/61pHAEJ4NML._AC_UX679_.jpg",
-                                       "rating": {
-                                         "rate": 3.6,
-                                         "count": 145
-                                       }
-                                     },
-                                   {
-                                       "id": 21,
-                                       "title": "Rolex Submariner",
-                                       "price": 12500.00,
-                                       "description": "Automatic, Stainless Steel, Waterproof, Luxury Watch",
-                                       "category": "men's clothing",
-                                       "image": "https://images-cdn.ubuy.co.in/635accf179b8dc1c1c52fe34-rolex-submariner-mechanical-automatic.jpg",
-                                       "rating": {
-                                         "rate": 4.8,
-                                         "count": 250
-                                       }
-                                     },
-                                     {
-                                       "id": 22,
-                                       "title": "Omega Speedmaster",
-                                       "price": 5200.00,
-                                       "description": "Chronograph, Stainless Steel, Moonwatch",
-                                       "category": "men's clothing",
-                                       "image": "https://images-cdn.ubuy.co.in/64f7557e5059112b8910baf0-omega-speedmaster-professional-moonwatch.jpg",
-                                       "rating": {
-                                         "rate": 4.7,
-                                         "count": 300
-                                       }
-                                     },
-                                     {
-                                       "id": 23,
-                                       "title": "Tag Heuer Carrera",
-                                       "price": 3500.00,
-                                       "description": "Automatic, Stainless Steel, Chronograph",
-                                       "category": "men's clothing",
-                                       "image": "https://cdn1.ethoswatches.com/media/catalog/product/cache/6e5de5bc3d185d8179cdc7258143f41a/t/a/tag-heuer-carrera-cbn201c-fc6542-large.jpg",
-                                       "rating": {
-                                         "rate": 4.5,
-                                         "count": 150
-                                       }
-                                     },
-                                     {
-                                       "id": 24,
-                                       "title": "Seiko Diver's Watch",
-                                       "price": 450.00,
-                                       "description": "Automatic, Stainless Steel, Water-Resistant",
-                                       "category": "men's clothing",
-                                       "image": "https://www.seikowatches.com/in-en/-/media/HtmlUploader/GlobalEn/Seiko/Home/products/prospex/special/55th-anniversary-limited-2nd/assets/image/main_l_img.png",
-                                       "rating": {
-                                         "rate": 4.3,
-                                         "count": 200
-                                       }
-                                     },
-                                     {
-                                       "id": 25,
-                                       "title": "Casio G-Shock",
-                                       "price": 99.00,
-                                       "description": "Digital, Resin, Shock-Resistant",
-                                       "category": "men's clothing",
-                                       "image": "https://www.casio.com/content/dam/casio/product-info/locales/in/en/timepiece/product/watch/G/GB/GBA/gba-900uu-5a/assets/GBA-900UU-5A.png.transform/main-visual-sp/image.png",
-                                       "rating": {
-                                         "rate": 4.6,
-                                         "count": 400
-                                       }
-                                     },
-                                     {
-                                       "id": 26,
-                                       "title": "Silk Necktie",
-                                       "price": 25.00,
-                                       "description": "100% Silk, Classic Design, Formal Wear",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/silk_necktie.jpg",
-                                       "rating": {
-                                         "rate": 4.4,
-                                         "count": 80
-                                       }
-                                     },
-                                     {
-                                       "id": 27,
-                                       "title": "Paisley Tie",
-                                       "price": 15.00,
-                                       "description": "Polyester, Paisley Pattern, Fashionable",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/paisley_tie.jpg",
-                                       "rating": {
-                                         "rate": 4.2,
-                                         "count": 65
-                                       }
-                                     },
-                                     {
-                                       "id": 28,
-                                       "title": "Striped Silk Tie",
-                                       "price": 30.00,
-                                       "description": "100% Silk, Striped Pattern, Business Wear",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/striped_silk_tie.jpg",
-                                       "rating": {
-                                         "rate": 4.5,
-                                         "count": 90
-                                       }
-                                     },
-                                     {
-                                       "id": 29,
-                                       "title": "Bow Tie",
-                                       "price": 12.00,
-                                       "description": "Polyester, Pre-Tied, Classic Style",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/bow_tie.jpg",
-                                       "rating": {
-                                         "rate": 4.1,
-                                         "count": 40
-                                       }
-                                     },
-                                     {
-                                       "id": 30,
-                                       "title": "Knitted Tie",
-                                       "price": 20.00,
-                                       "description": "Cotton, Knitted Design, Casual Wear",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/knitted_tie.jpg",
-                                       "rating": {
-                                         "rate": 4.3,
-                                         "count": 50
-                                       }
-                                     },
-                                     {
-                                       "id": 31,
-                                       "title": "Levi's 501 Original Fit Jeans",
-                                       "price": 69.99,
-                                       "description": "100% Cotton, Button Fly, Straight Leg",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/levis_501.jpg",
-                                       "rating": {
-                                         "rate": 4.6,
-                                         "count": 500
-                                       }
-                                     },
-                                     {
-                                       "id": 32,
-                                       "title": "Dockers Classic Fit Khakis",
-                                       "price": 45.00,
-                                       "description": "Cotton Blend, Pleated Front, Classic Fit",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/dockers_khakis.jpg",
-                                       "rating": {
-                                         "rate": 4.4,
-                                         "count": 300
-                                       }
-                                     },
-                                         {
-                                           "id": 33,
-                                           "title": "Adidas Track Pants",
-                                           "price": 50.00,
-                                           "description":"Polyester, Elastic Waist, Athletic Wear",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/adidas_trackpants.jpg",
-                                       "rating": {
-                                         "rate": 4.7,
-                                         "count": 350
-                                       }
-                                     },
-                                     {
-                                       "id": 34,
-                                       "title": "Wrangler Relaxed Fit Jeans",
-                                       "price": 39.99,
-                                       "description": "Cotton Blend, Relaxed Fit, Durable",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/wrangler_jeans.jpg",
-                                       "rating": {
-                                         "rate": 4.5,
-                                         "count": 200
-                                       }
-                                     },
-                                     {
-                                       "id": 35,
-                                       "title": "Under Armour Joggers",
-                                       "price": 55.00,
-                                       "description": "Polyester, Tapered Leg, Athletic Fit",
-                                       "category": "men's clothing",
-                                       "image": "https://fakestoreapi.com/img/underarmour_joggers.jpg",
-                                       "rating": {
-                                         "rate": 4.6,
-                                         "count": 250
-                                       }
-                                     }
-                                   ]
-                                   """
-
-    json_data = json.loads(json_input)
-    download_folder = "downloaded_images"
-
-    initialize_firebase()
-    main(json_data, download_folder)
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+    sys.exit(run_cli(args))